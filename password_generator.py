@@ -1,13 +1,26 @@
 # Password generator V2
-import secrets
-from cryptography.fernet import Fernet
+# cryptography, secrets, sqlite3, csv and the process pool are imported by the functions that
+# use them, so generating a password from a script doesn't pay for loading them
 import string
 import json
 import os
+import sys
+import argparse
+import time
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+from collections import OrderedDict
+from contextlib import contextmanager
+from collections.abc import MutableMapping
+from itertools import islice
+from bisect import bisect_left, insort
 
 
 # Generate a key for encryption (do this only once and save the key securely)
 def generate_key():
+    from cryptography.fernet import Fernet
     key = Fernet.generate_key()
     with open('key.key', 'wb') as key_file:
         key_file.write(key)
@@ -22,6 +35,25 @@ def load_key():
     with open('key.key', 'rb') as key_file:
         return key_file.read() # Return the key as bytes
 
+# During a key rotation key.key holds several keys, one per line, newest first
+def load_keys():
+    return load_key().split()
+
+# Fernet for the current key, it can still read tokens from older keys
+def load_fernet():
+    from cryptography.fernet import Fernet, MultiFernet
+    keys = load_keys()
+    if len(keys) == 1:
+        return Fernet(keys[0])
+    return MultiFernet([Fernet(key) for key in keys])
+
+def write_keys(keys):
+    with open('key.key.tmp', 'wb') as key_file:
+        key_file.write(b'\n'.join(keys))
+        key_file.flush()
+        os.fsync(key_file.fileno())
+    os.replace('key.key.tmp', 'key.key')
+
 # Encrypt the password
 def encrypt_password(password, fernet):
     return fernet.encrypt(password.encode()).decode()
@@ -30,12 +62,61 @@ def encrypt_password(password, fernet):
 def decrypt_password(encrypted_password, fernet):
     return fernet.decrypt(encrypted_password.encode()).decode()
 
+# Decrypts on demand and keeps the last few plaintexts for a short time
+class DecryptionCache:
+    def __init__(self, fernet, max_size=32, ttl=60):
+        self.fernet = fernet
+        self.max_size = max_size
+        self.ttl = ttl # Seconds a plaintext stays in memory
+        self.entries = OrderedDict() # login -> (encrypted_password, plaintext bytearray, expires at)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, login, encrypted_password):
+        self.expire()
+        entry = self.entries.get(login)
+        if entry and entry[0] == encrypted_password:
+            self.hits += 1
+            self.entries.move_to_end(login)
+            return entry[1].decode()
+
+        self.misses += 1
+        if entry:
+            self.invalidate(login) # The vault has a new ciphertext for this login
+        password = decrypt_password(encrypted_password, self.fernet)
+        self.entries[login] = (encrypted_password, bytearray(password.encode()), time.monotonic() + self.ttl)
+        while len(self.entries) > self.max_size:
+            self._evict(next(iter(self.entries)))
+        return password
+
+    # Drop one login, or everything when the vault changed as a whole
+    def invalidate(self, login=None):
+        if login is None:
+            for login in list(self.entries):
+                self._evict(login)
+        elif login in self.entries:
+            self._evict(login)
+
+    def expire(self):
+        now = time.monotonic()
+        for login in [login for login, entry in self.entries.items() if entry[2] <= now]:
+            self._evict(login)
+
+    def _evict(self, login):
+        plaintext = self.entries.pop(login)[1]
+        plaintext[:] = bytes(len(plaintext)) # Overwrite the cached copy before letting it go
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
 # Generate the password
 def generate_password(length):
     if length < 8:
         print("The minimun length for a strong password is 8 characters.")
         return None
     
+    import secrets
+
     # Define character sets
     upper_case = string.ascii_uppercase
     lower_case = string.ascii_lowercase
@@ -60,61 +141,856 @@ def generate_password(length):
     # Join the list of characters into a string
     return ''.join(password)
 
+# Character sets that every generated password must contain at least once
+DEFAULT_POLICY = (string.ascii_uppercase, string.ascii_lowercase, string.digits, string.punctuation)
+ENTROPY_BLOCK = 64 * 1024 # Bytes read from os.urandom at a time
+
+# Buffered os.urandom reader with unbiased helpers for bulk generation
+class EntropyBuffer:
+    def __init__(self, block_size=ENTROPY_BLOCK):
+        self.block_size = block_size
+        self.buffer = b''
+        self.pos = 0
+        self.tables = {}
+
+    def read(self, n):
+        if self.pos + n > len(self.buffer):
+            self.buffer = self.buffer[self.pos:] + os.urandom(max(self.block_size, n))
+            self.pos = 0
+        chunk = self.buffer[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    # Random integer in [0, n), bytes that would bias the result are rejected
+    def below(self, n):
+        size = 1 if n <= 256 else 4
+        space = 256 ** size
+        limit = space - space % n
+        while True:
+            value = int.from_bytes(self.read(size), 'big')
+            if value < limit:
+                return value % n
+
+    # k random characters of the alphabet, mapped with bytes.translate so the
+    # rejection sampling runs in C instead of once per character in Python
+    def choices(self, alphabet, k):
+        if alphabet not in self.tables:
+            if not 0 < len(alphabet) <= 256:
+                raise ValueError("The alphabet must have between 1 and 256 characters.")
+            limit = 256 - 256 % len(alphabet)
+            table = bytes(ord(alphabet[b % len(alphabet)]) if b < limit else 0 for b in range(256))
+            self.tables[alphabet] = (table, bytes(range(limit, 256)), limit)
+        table, rejected, limit = self.tables[alphabet]
+
+        chars = b''
+        while len(chars) < k:
+            missing = k - len(chars)
+            chars += self.read(missing * 256 // limit + 8).translate(table, rejected)
+        return chars[:k].decode('latin-1')
+
+# Generate many passwords at once, yields them one by one
+def generate_passwords(count, length, policy=None):
+    policy = tuple(policy or DEFAULT_POLICY)
+    if length < max(8, len(policy)):
+        raise ValueError("The minimun length for a strong password is 8 characters.")
+    for charset in policy:
+        if any(ord(char) > 255 for char in charset):
+            raise ValueError("Only single byte characters are supported in a policy.")
+    all_characters = ''.join(dict.fromkeys(''.join(policy))) # Keep order, drop duplicates
+    return _password_stream(count, length, policy, all_characters)
+
+def _password_stream(count, length, policy, all_characters, batch_size=1024):
+    entropy = EntropyBuffer()
+    slots_range = range(length)
+
+    while count > 0:
+        batch = min(count, batch_size)
+        count -= batch
+        bodies = entropy.choices(all_characters, batch * length)
+        required = [entropy.choices(charset, batch) for charset in policy]
+
+        # The j-th required character goes to one of the length - j slots still free,
+        # same distribution as adding them to the list and shuffling it
+        if length <= 256:
+            picks = [entropy.choices(''.join(map(chr, range(length - j))), batch) for j in range(len(policy))]
+        else:
+            picks = [''.join(chr(entropy.below(length - j)) for _ in range(batch)) for j in range(len(policy))]
+
+        for i in range(batch):
+            password = list(bodies[i * length:(i + 1) * length])
+            slots = list(slots_range)
+            for chars, pick in zip(required, picks):
+                password[slots.pop(ord(pick[i]))] = chars[i]
+            yield ''.join(password)
+
+# Offline breached-password check: SHA-1 hashes of leaked passwords compiled into a
+# Bloom filter file that is read through mmap, so it never has to fit in memory
+BREACH_INDEX = os.environ.get('PASSWORD_BREACH_INDEX', 'breached.bloom')
+BLOOM_MAGIC = b'PGBLOOM1'
+BLOOM_HEADER = 32 # magic, bit count (uint64), hash count (uint32), entries (uint64), padding
+BLOOM_BATCH = 1 << 16 # Hashes whose bits are set together when building the index
+
+def _bloom_positions(digest, bits, hashes):
+    # SHA-1 is already uniform, so two halves of it are enough for double hashing
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:16], 'little') | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+def _hash_lines(path):
+    # One hex SHA-1 per line, a ":count" suffix (as in the HIBP lists) is ignored
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                digest = bytes.fromhex(line.split(':', 1)[0])
+                if len(digest) != 20:
+                    raise ValueError(f"{path}: not a SHA-1 hash: {line}")
+                yield digest
+
+# _bloom_positions for a block of digests at once, one array of positions per hash function.
+# Everything stays reduced modulo bits, so uint64 never overflows and the positions are the same
+def _bloom_block_positions(digests, bits, hashes):
+    import numpy as np
+    block = np.frombuffer(b''.join(digests), dtype=np.uint8).reshape(-1, 20)
+    bits = np.uint64(bits)
+    h1 = block[:, :8].copy().view('<u8').ravel() % bits
+    h2 = (block[:, 8:16].copy().view('<u8').ravel() | np.uint64(1)) % bits
+    position = h1
+    for _ in range(hashes):
+        yield position
+        position = (position + h2) % bits
+
+def build_breach_index(hash_list, path=BREACH_INDEX, false_positive_rate=0.001):
+    import math
+    import mmap
+    import struct
+    import numpy as np
+
+    entries = sum(1 for _ in _hash_lines(hash_list))
+    bits = max(64, math.ceil(-entries * math.log(false_positive_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / max(entries, 1) * math.log(2)))
+
+    with open(path + '.tmp', 'w+b') as file:
+        file.truncate(BLOOM_HEADER + (bits + 7) // 8)
+        with mmap.mmap(file.fileno(), 0) as bloom:
+            bloom[:BLOOM_HEADER] = struct.pack('<8sQIQ4x', BLOOM_MAGIC, bits, hashes, entries)
+            bitmap = np.frombuffer(bloom, dtype=np.uint8, offset=BLOOM_HEADER)
+            for block in _chunks(_hash_lines(hash_list), BLOOM_BATCH):
+                for position in _bloom_block_positions(block, bits, hashes):
+                    np.bitwise_or.at(bitmap, (position >> np.uint64(3)).astype(np.intp), np.left_shift(1, position & np.uint64(7)).astype(np.uint8))
+            del bitmap # The mmap can't be closed while an array still points into it
+            bloom.flush()
+    os.replace(path + '.tmp', path)
+    print(f"Breach index built: {entries} hashes, {(bits + 7) // 8 / 2 ** 20:.1f} MiB, {hashes} hashes per entry.")
+    return entries
+
+class BreachIndex:
+    def __init__(self, path=BREACH_INDEX):
+        import mmap
+        import struct
+        with open(path, 'rb') as file:
+            self.bloom = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.bits, self.hashes, self.entries = struct.unpack('<8sQIQ4x', self.bloom[:BLOOM_HEADER])
+        if magic != BLOOM_MAGIC:
+            raise ValueError(f"{path} is not a breach index.")
+
+    # False positives are possible (at the rate the index was built for), misses are not
+    def __contains__(self, password):
+        import hashlib
+        digest = hashlib.sha1(password.encode()).digest()
+        bloom = self.bloom
+        for position in _bloom_positions(digest, self.bits, self.hashes):
+            if not bloom[BLOOM_HEADER + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def close(self):
+        self.bloom.close()
+
+def open_breach_index(path=BREACH_INDEX):
+    return BreachIndex(path) if os.path.exists(path) else None
+
+# Estimated entropy in bits, from the length and the kinds of characters used
+def password_entropy(password):
+    import math
+    pool = 0
+    for charset in DEFAULT_POLICY:
+        if any(char in charset for char in password):
+            pool += len(charset)
+    if any(not any(char in charset for charset in DEFAULT_POLICY) for char in password):
+        pool += 64 # Anything else, spaces, accents...
+    return len(password) * math.log2(pool) if pool else 0.0
+
+MIN_ENTROPY = 60 # Bits
+
+# Warnings about a password before it's saved, an empty list means it looks fine
+def check_password(password, breach_index=None):
+    warnings = []
+    if breach_index is not None and password in breach_index:
+        warnings.append("This password appears in the breached passwords list.")
+    entropy = password_entropy(password)
+    if entropy < MIN_ENTROPY:
+        warnings.append(f"This password is weak ({entropy:.0f} bits of entropy, {MIN_ENTROPY} recommended).")
+    return warnings
+
+# Vault files: a full snapshot plus an append-only journal of changes since it
+VAULT_FILE = 'password.json'
+JOURNAL_FILE = 'password.journal'
+LOCK_FILE = 'password.lock'
+COMPACT_EVERY = 1000 # Rewrite the snapshot after this many journal records
+
+# What this process has read of the files, so it only re-reads what another process changed
+journal_records = 0
+journal_offset = 0 # Bytes of the journal already replayed
+snapshot_stamp = None
+disk_generation = 0 # Bumped when changes read from the files are applied to the in-memory copy
+
+# Several processes can use the vault: readers share the lock, a writer takes it alone.
+# The lock is re-entrant within a process; without fcntl (Windows) it does nothing.
+lock_file = None
+lock_depth = 0
+lock_exclusive = False
+
+@contextmanager
+def vault_lock(exclusive=False):
+    global lock_file, lock_depth, lock_exclusive
+    if lock_depth:
+        if exclusive and not lock_exclusive:
+            raise RuntimeError("Can't upgrade a shared vault lock to an exclusive one.")
+        lock_depth += 1
+        try:
+            yield
+        finally:
+            lock_depth -= 1
+        return
+
+    if fcntl is not None:
+        if lock_file is None:
+            lock_file = open(LOCK_FILE, 'a+b')
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    lock_depth, lock_exclusive = 1, exclusive
+    try:
+        yield
+    finally:
+        lock_depth = 0
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# Replay the journal on top of the snapshot from where this process left off,
+# stop at a torn (half written) record
+def replay_journal(passwords):
+    global journal_records, journal_offset, disk_generation
+    if not os.path.exists(JOURNAL_FILE):
+        return passwords
+    start = journal_offset
+
+    with open(JOURNAL_FILE, 'rb') as journal:
+        journal.seek(journal_offset)
+        for line in journal:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+                op, login = record['op'], record['login']
+            except (ValueError, KeyError):
+                break
+            if op == 'set':
+                passwords[login] = record['password']
+            elif op == 'del':
+                passwords.pop(login, None)
+            journal_offset += len(line)
+            journal_records += 1
+    if journal_offset != start:
+        disk_generation += 1
+    return passwords
+
 # Load the passwords that are saved
 def load_password():
-    if os.path.exists('password.json'):
-        with open('password.json', 'r') as file:
-            return json.load(file)
-    return {}
+    global journal_records, journal_offset, snapshot_stamp, disk_generation
+    disk_generation += 1
+    with vault_lock():
+        passwords = {}
+        snapshot_stamp = _file_stamp(VAULT_FILE)
+        if snapshot_stamp:
+            with open(VAULT_FILE, 'r') as file:
+                passwords = json.load(file)
+        journal_records = journal_offset = 0
+        return replay_journal(passwords)
+
+# Bring an in-memory copy up to date with what other processes committed. Costs two
+# stat calls when nothing changed, replays only the new journal records when only
+# the journal grew, and re-parses the snapshot only after a compaction.
+def refresh_password(passwords):
+    if _file_stamp(VAULT_FILE) == snapshot_stamp and (_file_stamp(JOURNAL_FILE) or (0, 0, 0))[2] == journal_offset:
+        return False
+    with vault_lock():
+        if _file_stamp(VAULT_FILE) != snapshot_stamp:
+            fresh = load_password()
+            passwords.clear()
+            passwords.update(fresh)
+        else:
+            replay_journal(passwords)
+    return True
 
-# Save the passwords to a file
+# Save the passwords to a file (full snapshot, this also empties the journal)
 def save_password(passwords):
-    with open('password.json', 'w') as file:
-        json.dump(passwords, file, indent=4) # Create the file if it doesn't exist
+    global journal_records, journal_offset, snapshot_stamp
+    with vault_lock(exclusive=True):
+        tmp_file = VAULT_FILE + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(passwords, file, indent=4) # Create the file if it doesn't exist
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_file, VAULT_FILE) # Readers see the old or the new snapshot, never half of one
+        if os.path.exists(JOURNAL_FILE):
+            os.remove(JOURNAL_FILE)
+        journal_records = journal_offset = 0
+        snapshot_stamp = _file_stamp(VAULT_FILE)
+
+# Snapshot an in-memory copy without losing what other processes wrote meanwhile
+def compact_password(passwords):
+    with vault_lock(exclusive=True):
+        refresh_password(passwords)
+        save_password(passwords)
+
+# Append changes to the journal with a single fsync, compact it when it gets too long
+def log_changes(passwords, records):
+    global journal_records, journal_offset
+    if not records:
+        return
+    with vault_lock(exclusive=True):
+        # Catch up with other writers, then apply ours again on top so memory matches the file order
+        refresh_password(passwords)
+        for record in records:
+            if record['op'] == 'set':
+                passwords[record['login']] = record['password']
+            else:
+                passwords.pop(record['login'], None)
+
+        with open(JOURNAL_FILE, 'ab') as journal:
+            journal.truncate(journal_offset) # Drop a torn record left by a writer that crashed
+            data = b''.join(json.dumps(record).encode() + b'\n' for record in records)
+            journal.write(data)
+            journal.flush()
+            os.fsync(journal.fileno())
+        journal_records += len(records)
+        journal_offset += len(data)
+        # Grows with the vault so big imports don't rewrite the snapshot over and over
+        if journal_records >= max(COMPACT_EVERY, len(passwords) // 2):
+            save_password(passwords)
+
+def journal_record(op, login, encrypted_password=None):
+    record = {'op': op, 'login': login}
+    if encrypted_password is not None:
+        record['password'] = encrypted_password
+    return record
+
+# Append one change to the journal
+def log_change(passwords, op, login, encrypted_password=None):
+    log_changes(passwords, [journal_record(op, login, encrypted_password)])
+
+# Optional SQLite storage, works like the passwords dict but keeps logins indexed on disk
+DB_FILE = 'password.db'
+VAULT_BACKEND = os.environ.get('PASSWORD_VAULT_BACKEND', 'json') # "json" or "sqlite"
+PAGE_SIZE = 20 # Logins shown at a time by list_logins
+
+class SqliteVault(MutableMapping):
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        import sqlite3
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL') # Readers don't block the writer
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        # The primary key is the index used for exact, prefix and paged lookups
+        self.conn.execute('CREATE TABLE IF NOT EXISTS logins (login TEXT PRIMARY KEY, password TEXT NOT NULL) WITHOUT ROWID')
+        self.conn.commit()
+
+    def __getitem__(self, login):
+        row = self.conn.execute('SELECT password FROM logins WHERE login = ?', (login,)).fetchone()
+        if row is None:
+            raise KeyError(login)
+        return row[0]
+
+    def __setitem__(self, login, encrypted_password):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO logins VALUES (?, ?)', (login, encrypted_password))
+
+    def __delitem__(self, login):
+        with self.conn:
+            if self.conn.execute('DELETE FROM logins WHERE login = ?', (login,)).rowcount == 0:
+                raise KeyError(login)
+
+    def __contains__(self, login):
+        return self.conn.execute('SELECT 1 FROM logins WHERE login = ?', (login,)).fetchone() is not None
+
+    def __iter__(self):
+        for (login,) in self.conn.execute('SELECT login FROM logins ORDER BY login'):
+            yield login
+
+    def items(self):
+        return self.conn.execute('SELECT login, password FROM logins ORDER BY login')
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM logins').fetchone()[0]
+
+    def __bool__(self):
+        return self.conn.execute('SELECT 1 FROM logins LIMIT 1').fetchone() is not None
+
+    # Logins only, ciphertexts are fetched with vault[login] when they're needed
+    def find(self, text='', limit=PAGE_SIZE, offset=0, substring=False):
+        if substring and text:
+            # Can't use the index, but it only scans the login column
+            query = "SELECT login FROM logins WHERE instr(login, ?) > 0 ORDER BY login LIMIT ? OFFSET ?"
+            params = (text, limit, offset)
+        else:
+            # A range on the primary key, so the prefix search is an index seek
+            query = 'SELECT login FROM logins WHERE login >= ? AND login < ? ORDER BY login LIMIT ? OFFSET ?'
+            params = (text, text + '\U0010ffff', limit, offset)
+        return [login for (login,) in self.conn.execute(query, params)]
+
+    # Writes that wait for commit(), used to batch many changes in one transaction
+    def put(self, login, encrypted_password):
+        self.conn.execute('INSERT OR REPLACE INTO logins VALUES (?, ?)', (login, encrypted_password))
+
+    def remove(self, login):
+        return self.conn.execute('DELETE FROM logins WHERE login = ?', (login,)).rowcount > 0
+
+    def commit(self):
+        self.conn.commit()
+
+    # Copy many entries in one transaction
+    def update_many(self, entries):
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO logins VALUES (?, ?)', entries)
+
+    def close(self):
+        self.conn.close()
+
+    def reopen(self):
+        self.__init__(self.path)
+
+# Open the vault with the configured backend
+def open_vault(backend=None):
+    backend = backend or VAULT_BACKEND
+    if backend == 'sqlite':
+        is_new = not os.path.exists(DB_FILE)
+        vault = SqliteVault(DB_FILE)
+        if is_new and (os.path.exists(VAULT_FILE) or os.path.exists(JOURNAL_FILE)):
+            vault.update_many(load_password().items()) # First run, bring over the JSON vault
+            print(f"Imported the JSON vault into {DB_FILE}.")
+        return vault
+    return load_password()
+
+# Logins matching a prefix (or substring), one page at a time. index is an optional sorted
+# list of the logins, a prefix search on it is a binary search instead of a scan
+def find_logins(passwords, text='', limit=PAGE_SIZE, offset=0, substring=False, index=None):
+    if isinstance(passwords, SqliteVault):
+        return passwords.find(text, limit, offset, substring)
+    if index is not None and not substring:
+        start = bisect_left(index, text) + offset
+        return [login for login in index[start:start + limit] if login.startswith(text)]
+    if substring:
+        matches = (login for login in passwords if text in login)
+    else:
+        matches = (login for login in passwords if login.startswith(text))
+    return list(islice(matches, offset, offset + limit))
+
+# Bulk crypto (rotation, import, export) runs in chunks on a pool of processes
+CHUNK_SIZE = 2000
+
+worker_fernet = None
+
+def _init_worker(keys):
+    global worker_fernet
+    from cryptography.fernet import Fernet, MultiFernet
+    worker_fernet = MultiFernet([Fernet(key) for key in keys]) # Encrypts with keys[0]
+
+def _rotate_chunk(chunk):
+    return [(login, worker_fernet.rotate(token.encode()).decode()) for login, token in chunk]
+
+# Entries the worker's keys can't read, used to check a rotation before the old key goes
+def _stale_chunk(chunk):
+    from cryptography.fernet import InvalidToken
+    stale = []
+    for login, token in chunk:
+        try:
+            worker_fernet.decrypt(token.encode())
+        except InvalidToken:
+            stale.append((login, token))
+    return stale
+
+def _encrypt_chunk(chunk):
+    return [(login, encrypt_password(password, worker_fernet)) for login, password in chunk]
+
+def _decrypt_chunk(chunk):
+    return [(login, decrypt_password(token, worker_fernet)) for login, token in chunk]
+
+def _chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+# Like executor.map, but only keeps a few chunks in flight so memory stays flat
+def _bounded_map(executor, function, chunks, window):
+    pending = []
+    for chunk in chunks:
+        pending.append(executor.submit(function, chunk))
+        if len(pending) >= window:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+# Apply a chunk function to the items, in order, with the given keys loaded in every worker
+def map_chunks(function, items, keys, workers=None, chunk_size=CHUNK_SIZE):
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        _init_worker(keys)
+        yield from map(function, _chunks(items, chunk_size))
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(keys,)) as executor:
+        yield from _bounded_map(executor, function, _chunks(items, chunk_size), workers * 2)
+
+# All entries of a SQLite vault, a page at a time, so the table can be updated while they're read
+def _sqlite_pages(conn, size=CHUNK_SIZE):
+    rows = conn.execute('SELECT login, password FROM logins ORDER BY login LIMIT ?', (size,)).fetchall()
+    while rows:
+        yield from rows
+        rows = conn.execute('SELECT login, password FROM logins WHERE login > ? ORDER BY login LIMIT ?', (rows[-1][0], size)).fetchall()
+
+def _update_sqlite(conn, entries):
+    conn.executemany('UPDATE logins SET password = ? WHERE login = ?', [(token, login) for login, token in entries])
+
+# Re-encrypt in place in one transaction: other writers are held off until the commit,
+# readers keep the old tokens until then, which both keys can read
+def _rotate_sqlite(vault, rotated):
+    conn = vault.conn
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for chunk in rotated(_sqlite_pages(conn)):
+            _update_sqlite(conn, chunk)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+# Rotate a copy without the lock, then only hold it to catch up with what other processes
+# wrote meanwhile and to swap the new snapshot in
+def _rotate_json(passwords, rotated, keys):
+    refresh_password(passwords)
+    base = dict(passwords)
+    new_passwords = {}
+    for chunk in rotated(base.items()):
+        new_passwords.update(chunk)
+
+    with vault_lock(exclusive=True):
+        refresh_password(passwords)
+        changed = [(login, token) for login, token in passwords.items() if base.get(login) != token]
+        for login in base.keys() - passwords.keys():
+            del new_passwords[login]
+        for chunk in map_chunks(_rotate_chunk, changed, keys, workers=1):
+            new_passwords.update(chunk)
+        save_password(new_passwords)
+    passwords.clear()
+    passwords.update(new_passwords)
+
+# Check every entry on disk reads with the new key alone, re-encrypt any that don't (written
+# with the old key by a process that hadn't seen the rotation), then drop the old keys
+# unless another vault still has to be checked
+def _finish_rotation(passwords, new_key, keys, workers, drop_old_keys=True):
+    if isinstance(passwords, SqliteVault):
+        conn = passwords.conn
+        conn.execute('BEGIN IMMEDIATE') # Nobody writes between the check and the commit
+        try:
+            stale = [entry for chunk in map_chunks(_stale_chunk, _sqlite_pages(conn), [new_key], workers) for entry in chunk]
+            for chunk in map_chunks(_rotate_chunk, stale, keys, workers=1):
+                _update_sqlite(conn, chunk)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if drop_old_keys:
+            write_keys([new_key])
+        return len(stale)
+
+    refresh_password(passwords)
+    checked = dict(passwords)
+    stale = dict(entry for chunk in map_chunks(_stale_chunk, checked.items(), [new_key], workers) for entry in chunk)
+    with vault_lock(exclusive=True):
+        # Only what changed since the check is looked at again under the lock
+        refresh_password(passwords)
+        changed = [(login, token) for login, token in passwords.items() if checked.get(login) != token]
+        stale = {login: token for login, token in stale.items() if passwords.get(login) == token}
+        for chunk in map_chunks(_stale_chunk, changed, [new_key], workers=1):
+            stale.update(chunk)
+        records = [journal_record('set', login, token) for chunk in map_chunks(_rotate_chunk, stale.items(), keys, workers=1) for login, token in chunk]
+        log_changes(passwords, records)
+        if drop_old_keys:
+            write_keys([new_key])
+    return len(stale)
+
+def rotate_key(passwords, workers=None):
+    from cryptography.fernet import Fernet
+    old_keys = load_keys()
+    new_key = Fernet.generate_key()
+    keys = [new_key] + old_keys
+    write_keys(keys) # From now on both the old and the new tokens can be read, new writes use the new key
+
+    # Both backends share key.key, so a vault the other backend left behind (the JSON files
+    # after the move to SQLite, say) is rotated first, or it couldn't be read anymore
+    vaults = [passwords]
+    if isinstance(passwords, SqliteVault):
+        if os.path.exists(VAULT_FILE) or os.path.exists(JOURNAL_FILE):
+            vaults.insert(0, load_password())
+    elif os.path.exists(DB_FILE):
+        vaults.insert(0, SqliteVault(DB_FILE))
+
+    total = sum(len(vault) for vault in vaults)
+    done = 0
+    start = time.perf_counter()
+
+    def rotated(items):
+        nonlocal done
+        for chunk in map_chunks(_rotate_chunk, items, keys, workers):
+            done += len(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"Rotated {done}/{total} entries ({done / elapsed:.0f} entries/s)", end='\r')
+            yield chunk
+
+    late = 0
+    for vault in vaults:
+        if isinstance(vault, SqliteVault):
+            _rotate_sqlite(vault, rotated)
+        else:
+            _rotate_json(vault, rotated, keys)
+        late += _finish_rotation(vault, new_key, keys, workers, drop_old_keys=vault is passwords)
+        if vault is not passwords and isinstance(vault, SqliteVault):
+            vault.close()
+    elapsed = time.perf_counter() - start
+    print(f"\nKey rotated: {total} entries in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} entries/s).")
+    if late:
+        print(f"{late} entries written with the old key during the rotation were re-encrypted.")
+    return Fernet(new_key)
+
+# Collects vault changes and writes them to disk together
+class BatchWriter:
+    def __init__(self, passwords, batch_size=1000, index=None):
+        self.passwords = passwords
+        self.batch_size = batch_size
+        self.index = index # Sorted logins of a JSON vault, kept up to date with the writes
+        self.pending = [] # Journal records, or just a count for SQLite
+
+    def set(self, login, encrypted_password):
+        if isinstance(self.passwords, SqliteVault):
+            self.passwords.put(login, encrypted_password)
+        else:
+            if self.index is not None and login not in self.passwords:
+                insort(self.index, login)
+            self.passwords[login] = encrypted_password
+        self._add(journal_record('set', login, encrypted_password))
+
+    def delete(self, login):
+        if isinstance(self.passwords, SqliteVault):
+            if not self.passwords.remove(login):
+                return False
+        elif self.passwords.pop(login, None) is None:
+            return False
+        elif self.index is not None:
+            position = bisect_left(self.index, login)
+            if position < len(self.index) and self.index[position] == login:
+                del self.index[position]
+        self._add(journal_record('del', login))
+        return True
+
+    def _add(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if isinstance(self.passwords, SqliteVault):
+            self.passwords.commit()
+        else:
+            log_changes(self.passwords, self.pending)
+        self.pending = []
 
 # Add or update the password
-def add_or_update_login(passwords, login, password, fernet):
+def add_or_update_login(passwords, login, password, fernet, cache=None):
     if not login or not isinstance(login, str):
         print("Error: the login must be a valid string.")
         return
     encrypted_password = encrypt_password(password, fernet) # Encrypt the password before saving
     passwords[login] = encrypted_password
-    save_password(passwords)
+    if isinstance(passwords, dict): # SQLite commits on its own
+        log_change(passwords, 'set', login, encrypted_password)
+    if cache:
+        cache.invalidate(login)
     print(f"Saved login: {login}")
 
 # Delete a password
-def delete_login_and_password(passwords, login):
+def delete_login_and_password(passwords, login, cache=None):
     if login in passwords:
         del passwords[login]
-        save_password(passwords)
+        if isinstance(passwords, dict):
+            log_change(passwords, 'del', login)
+        if cache:
+            cache.invalidate(login)
     else:
         print("Login was not found.")
 
-# List all logins and give an option to see the passwords
-def list_logins(passwords, fernet):
-    if passwords:
+# List the logins a page at a time and give an option to see the passwords
+def list_logins(passwords, fernet, cache=None):
+    if not passwords:
+        print("There aren't any saved logins.")
+        return
+
+    text = input("\nFilter logins (start with * to search inside them, press enter to show all): ").strip()
+    substring = text.startswith('*')
+    text = text.lstrip('*')
+
+    offset = 0
+    while True:
+        page = find_logins(passwords, text, PAGE_SIZE, offset, substring)
+        if not page:
+            print("No more logins." if offset else "No logins match.")
+            return
+
         print("\nLogins saved:")
-        for index, login in enumerate(passwords):
-            print(f"{index+1}. {login}")
+        for index, login in enumerate(page, start=offset + 1):
+            print(f"{index}. {login}")
 
-        choice = input("\nSelect the number of a login to see the password (Press enter to cancel): ")
+        choice = input("\nSelect the number of a login to see the password (n for the next page, press enter to cancel): ").strip()
+        if choice.lower() == 'n':
+            offset += PAGE_SIZE
+            continue
         if choice:
             try:
-                choice = int(choice) - 1
-                login = list(passwords.keys())[choice]
-                decrypted_password = decrypt_password(passwords[login], fernet) # Decrypt the password before displaying
+                index = int(choice) - 1 - offset
+                if index < 0:
+                    raise IndexError
+                login = page[index]
+                # Decrypt the password before displaying
+                if cache:
+                    decrypted_password = cache.get(login, passwords[login])
+                else:
+                    decrypted_password = decrypt_password(passwords[login], fernet)
                 print(f"'{login}': {decrypted_password}")
             except (ValueError, IndexError):
                 print("Invalid selection.")
-    else:
-        print("There aren't any saved logins.")
+        return
 
-def menu():
-    # Load encryption key and initialize Fernet
-    key = load_key()
-    fernet = Fernet(key)
+# Key and vault are loaded once, the first time an operation needs them
+class Session:
+    def __init__(self, backend=None, index_logins=False):
+        self.backend = backend
+        self.index_logins = index_logins # Keep a sorted index of a JSON vault's logins, for long-lived sessions
+        self._fernet = None
+        self._key_stamp = None
+        self._passwords = None
+        self._writer = None
+        self._cache = None
+        self._breach_index = False # Not looked for yet
+        self._login_index = []
+        self._index_generation = None
+
+    # Reloaded when key.key changes, a key rotation by another process replaces it
+    @property
+    def fernet(self):
+        if self._fernet is not None and _file_stamp('key.key') != self._key_stamp:
+            self.reload_key()
+        if self._fernet is None:
+            self._fernet = load_fernet()
+            self._key_stamp = _file_stamp('key.key')
+        return self._fernet
+
+    # Checked against the files on every use, in case another process changed them
+    @property
+    def passwords(self):
+        self.expire_cache()
+        if self._passwords is None:
+            self._passwords = open_vault(self.backend)
+        elif isinstance(self._passwords, dict):
+            refresh_password(self._passwords)
+        return self._passwords
+
+    @property
+    def cache(self):
+        fernet = self.fernet # Checks the key first, a new key also means a new cache
+        if self._cache is None:
+            self._cache = DecryptionCache(fernet)
+        return self._cache
+
+    # Zero the plaintexts past their TTL. Runs on every use of the vault, and on a timer in the
+    # agent, rather than only on the next lookup
+    def expire_cache(self):
+        if self._cache:
+            self._cache.expire()
+
+    # None when there's no breach index file
+    @property
+    def breach_index(self):
+        if self._breach_index is False:
+            self._breach_index = open_breach_index()
+        return self._breach_index
+
+    # After a key rotation
+    def reload_key(self):
+        if self._cache:
+            self._cache.invalidate()
+        self._fernet = None
+        self._cache = None
+
+    # Sorted logins of the JSON vault. The writer keeps it up to date with this session's
+    # writes, it's only rebuilt after reading another process's changes from the files.
+    # None without index_logins or with SQLite, which has its own index
+    @property
+    def login_index(self):
+        if not self.index_logins or not isinstance(self._passwords, dict):
+            return None
+        if self._index_generation != disk_generation:
+            self._login_index[:] = sorted(self._passwords)
+            self._index_generation = disk_generation
+        return self._login_index
+
+    @property
+    def writer(self):
+        if self._writer is None:
+            passwords = self.passwords
+            index = self._login_index if self.index_logins and isinstance(passwords, dict) else None
+            self._writer = BatchWriter(passwords, index=index)
+        return self._writer
 
-    passwords = load_password()
+    # Commit the writes that are waiting in the batch
+    def flush(self):
+        if self._writer:
+            self._writer.flush()
+
+    # compact=True also folds the journal into the JSON snapshot
+    def close(self, compact=False):
+        if self._writer:
+            self._writer.flush()
+        if self._cache:
+            self._cache.invalidate()
+        if self._breach_index:
+            self._breach_index.close()
+        if isinstance(self._passwords, SqliteVault):
+            self._passwords.close()
+        elif compact and self._passwords is not None and journal_records:
+            compact_password(self._passwords) # Nothing to fold in when the journal is empty
+
+def menu():
+    # The encryption key and the vault are loaded the first time an option needs them
+    session = Session()
 
     while True:
         print("\n--- Password Generator ---")
@@ -122,27 +998,32 @@ def menu():
         print("2. Save a new password")
         print("3. List logins")
         print("4. Delete a password")
-        print("5. Close program")
+        print("5. Rotate encryption key")
+        print("6. Close program")
 
         try:
-            option = int(input("Select an option (1, 2, 3, 4, 5): ").strip())
+            option = int(input("Select an option (1, 2, 3, 4, 5, 6): ").strip())
         except ValueError:
-            print("Invalid input. Please enter a number between 1 and 5.")
+            print("Invalid input. Please enter a number between 1 and 6.")
             continue
 
         if option == 1:
-            length = int(input("How many caracters should the password have?: ").strip())
+            try:
+                length = int(input("How many caracters should the password have?: ").strip())
+            except ValueError:
+                print("Invalid input. Please enter a valid number.")
+                continue
             new_password = generate_password(length)
             if new_password:
                 print(f"\nPassword generated: {new_password}")
 
         elif option == 2:
             login = input("\nInsert the login (page in which you'll be using the password): ").strip()
-            if login in passwords:
+            if login in session.passwords:
                 confirm = input(f"A password already exists for '{login}' Overwrite it? (y/n): ").strip().lower()
                 if confirm != 'y':
                     print("Operation cancelled.")
-                    return
+                    continue
 
             password = input("Enter password (leave blank to generate one): ").strip()
 
@@ -151,40 +1032,530 @@ def menu():
 
                 # Verify if the input is blank
                 if not length_input:
-                    return
+                    continue
 
                 try: 
                     length = int(length_input)
                 except ValueError:
                     print("Invalid input. Please enter a valid number.")
-                    return
+                    continue
 
                 # Generate password
                 password = generate_password(length)
 
             if password:
-                add_or_update_login(passwords, login, password, fernet)
+                warnings = check_password(password, session.breach_index)
+                for warning in warnings:
+                    print(f"Warning: {warning}")
+                if warnings and input("Save it anyway? (y/n): ").strip().lower() != 'y':
+                    print("Operation cancelled.")
+                    continue
+                add_or_update_login(session.passwords, login, password, session.fernet, session.cache)
             else:
                 print("Password generation failed.")
 
         elif option == 3:
-            list_logins(passwords, fernet)
+            list_logins(session.passwords, session.fernet, session.cache)
 
         elif option == 4:
             login = input("Enter the login to delete: ")
             confirm = input(f"Are you sure you want to delete the login '{login}'? (y/n): ").strip().lower()
             if confirm == 'y':
-                delete_login_and_password(passwords, login)
+                delete_login_and_password(session.passwords, login, session.cache)
                 print('Password deleted')
             else:
                 print("Operation cancelled.")
 
         elif option == 5:
+            confirm = input("Re-encrypt every password with a new key? (y/n): ").strip().lower()
+            if confirm == 'y':
+                rotate_key(session.passwords)
+                session.reload_key()
+            else:
+                print("Operation cancelled.")
+
+        elif option == 6:
+            session.close(compact=True) # Compact the journal into the snapshot
             print("Closing the program...")
             break
 
         else:
             print("Invalid option. Try again.")
 
+# Headless use: subcommands and a JSON-lines mode that runs a stream of operations
+DEFAULT_LENGTH = 16
+
+# Run one operation, returns a dict with the result or raises ValueError/KeyError
+def run_operation(request, session):
+    op = request.get('op')
+
+    if op == 'generate':
+        count = int(request.get('count', 1))
+        length = int(request.get('length', DEFAULT_LENGTH))
+        return {'passwords': list(generate_passwords(count, length))}
+
+    if op in ('set', 'get', 'delete'):
+        login = request.get('login')
+        if not login or not isinstance(login, str):
+            raise ValueError("the login must be a valid string.")
+
+    if op == 'set':
+        password = request.get('password')
+        if password is not None and not isinstance(password, str):
+            raise ValueError("the password must be a string.")
+        generated = not password
+        if generated:
+            password = next(generate_passwords(1, int(request.get('length', DEFAULT_LENGTH))))
+        # Checked before anything is stored, strict refuses a password with warnings
+        warnings = check_password(password, session.breach_index)
+        if warnings and request.get('strict'):
+            raise ValueError(f"the password for {login} was not saved: {' '.join(warnings)}")
+        session.writer.set(login, encrypt_password(password, session.fernet))
+        result = {'login': login, 'password': password} if generated else {'login': login}
+        if warnings:
+            result['warnings'] = warnings
+        return result
+
+    if op == 'check':
+        password = request.get('password')
+        if not isinstance(password, str):
+            raise ValueError("the password must be a string.")
+        return {'entropy': round(password_entropy(password), 1), 'warnings': check_password(password, session.breach_index)}
+
+    if op == 'get':
+        return {'login': login, 'password': session.cache.get(login, session.passwords[login])}
+
+    if op == 'delete':
+        if not session.writer.delete(login):
+            raise KeyError(login)
+        return {'login': login}
+
+    if op == 'list':
+        limit = int(request.get('limit', PAGE_SIZE))
+        offset = int(request.get('offset', 0))
+        text = request.get('search') or request.get('prefix') or ''
+        passwords = session.passwords
+        return {'logins': find_logins(passwords, text, limit, offset, 'search' in request, session.login_index)}
+
+    raise ValueError(f"unknown operation: {op}")
+
+# cryptography's InvalidToken, imported only once a decryption has failed. Used in an except
+# clause, so the generate-only path never imports cryptography
+def _invalid_token():
+    from cryptography.fernet import InvalidToken
+    return InvalidToken
+
+def decrypt_error(login=None):
+    entry = f"the password for {login}" if login else "a password"
+    return f"can't decrypt {entry}: wrong key or corrupted entry"
+
+# Run one JSON operation line, returns the result dict (None for a blank line)
+def run_line(line, session):
+    if not line.strip():
+        return None
+    request = {}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            request = {}
+            raise ValueError("each line must be a JSON object")
+        result = {'ok': True, **run_operation(request, session)}
+    except KeyError as e:
+        result = {'ok': False, 'error': f"login not found: {e.args[0]}"}
+    except (ValueError, TypeError) as e:
+        result = {'ok': False, 'error': str(e)}
+    except _invalid_token():
+        result = {'ok': False, 'error': decrypt_error(request.get('login'))}
+    if 'id' in request:
+        result['id'] = request['id']
+    return result
+
+# Read one JSON operation per line from stdin, write one JSON result per line
+def run_jsonl(session, source=None, out=None):
+    source = source or sys.stdin
+    out = out or sys.stdout
+    failures = 0
+    for line in source:
+        result = run_line(line, session)
+        if result is None:
+            continue
+        failures += not result['ok']
+        out.write(json.dumps(result) + '\n')
+    out.flush()
+    return failures
+
+# Long-lived agent, like ssh-agent: holds the key and the vault in memory and answers the same
+# JSON-lines operations over a Unix socket, so scripts don't pay the cold start on every lookup.
+# Operations run one at a time on the event loop (each is far below a millisecond), while
+# any number of clients stay connected. Changes other processes make to the files are picked up
+# before each operation, and writes are committed before the reply.
+AGENT_SOCKET = os.environ.get('PASSWORD_AGENT_SOCKET', 'password-agent.sock')
+AGENT_LINE_LIMIT = 2 ** 16 # Longest request line, in bytes
+AGENT_EXPIRE_EVERY = 1 # Seconds between two sweeps of the decryption cache
+
+class VaultAgent:
+    def __init__(self, session):
+        self.session = session
+        self.clients = 0
+        self.requests = 0
+
+    # One request line, None for a line over the limit, which is skipped up to its end so
+    # the next request is still read from its start
+    async def read_line(self, reader):
+        import asyncio
+        try:
+            return await reader.readuntil(b'\n')
+        except asyncio.IncompleteReadError as e:
+            return e.partial # The last line had no newline, or the client is done
+        except asyncio.LimitOverrunError as e:
+            overrun = e
+        while True:
+            try:
+                await reader.readexactly(overrun.consumed)
+                await reader.readuntil(b'\n')
+                return None
+            except asyncio.LimitOverrunError as e:
+                overrun = e
+            except asyncio.IncompleteReadError:
+                return None
+
+    async def handle(self, reader, writer):
+        self.clients += 1
+        try:
+            while True:
+                line = await self.read_line(reader)
+                if line is None:
+                    result = {'ok': False, 'error': f"request line longer than {AGENT_LINE_LIMIT} bytes"}
+                elif not line:
+                    break
+                else:
+                    result = run_line(line.decode(), self.session)
+                    self.session.flush()
+                if result is not None:
+                    self.requests += 1
+                    writer.write(json.dumps(result).encode() + b'\n')
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+def serve_agent(path=AGENT_SOCKET, backend=None):
+    import asyncio
+    import signal
+    import socket
+    if os.path.exists(path):
+        with socket.socket(socket.AF_UNIX) as probe:
+            try:
+                probe.connect(path)
+            except OSError:
+                os.remove(path) # Left behind by an agent that died
+            else:
+                raise ValueError(f"an agent is already listening on {path}")
+
+    session = Session(backend, index_logins=True)
+    # Load now rather than on the first request
+    session.fernet
+    session.passwords
+    agent = VaultAgent(session)
+
+    async def serve():
+        umask = os.umask(0o177) # Only this user can connect
+        try:
+            server = await asyncio.start_unix_server(agent.handle, path, limit=AGENT_LINE_LIMIT)
+        finally:
+            os.umask(umask)
+        loop = asyncio.get_running_loop()
+
+        # Cached plaintexts go when their TTL is up, even if no request comes in
+        def expire():
+            session.expire_cache()
+            loop.call_later(AGENT_EXPIRE_EVERY, expire)
+        expire()
+
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+        print(f"Vault agent listening on {path} (PASSWORD_AGENT_SOCKET={path})", file=sys.stderr)
+        async with server:
+            await stop
+
+    try:
+        asyncio.run(serve())
+    finally:
+        session.close()
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"Vault agent stopped after {agent.requests} requests.", file=sys.stderr)
+    return 0
+
+# Send one operation to a running agent, returns its result dict
+def agent_request(request, path=AGENT_SOCKET):
+    import socket
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as reply:
+            line = reply.readline()
+    if not line:
+        raise ValueError(f"the agent on {path} closed the connection without replying")
+    return json.loads(line)
+
+# Plaintext logins as CSV (login,password header) or JSON lines ({"login": ..., "password": ...})
+def file_format(path, fmt=None):
+    return fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+
+# A bad line stops the import with a ValueError that gives its line number
+def read_entries(file, fmt):
+    if fmt == 'csv':
+        import csv
+        reader = csv.DictReader(file)
+        if not {'login', 'password'} <= set(reader.fieldnames or ()):
+            raise ValueError("the CSV file needs a header with login and password columns")
+        for row in reader:
+            yield _entry(row.get('login'), row.get('password'), reader.line_num)
+    else:
+        for number, line in enumerate(file, 1):
+            if line.strip():
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"line {number}: {e}")
+                if not isinstance(entry, dict):
+                    raise ValueError(f"line {number}: each line must be a JSON object")
+                yield _entry(entry.get('login'), entry.get('password'), number)
+
+def _entry(login, password, number):
+    if not login or not isinstance(login, str):
+        raise ValueError(f"line {number}: missing or empty login")
+    if not password or not isinstance(password, str):
+        raise ValueError(f"line {number}: missing or empty password for {login}")
+    return login, password
+
+# newline='' both ways, the csv module handles line endings itself (a password can contain them).
+# An export holds every password in plaintext, so only this user can read it
+def open_text(path, mode):
+    if path == '-':
+        if mode == 'r':
+            sys.stdin.reconfigure(newline='')
+            return sys.stdin
+        return sys.stdout
+    if mode == 'r':
+        return open(path, mode, newline='')
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    if hasattr(os, 'fchmod'):
+        os.fchmod(fd, 0o600) # Also when the file was already there
+    return os.fdopen(fd, mode, newline='')
+
+# The checks of a single set, run before encryption: a flagged password is reported on
+# stderr, and left out with strict
+def _checked_entries(entries, breach_index, strict):
+    for login, password in entries:
+        warnings = check_password(password, breach_index)
+        if warnings:
+            print(f"Warning: {login}: {' '.join(warnings)}{' Skipped.' if strict else ''}", file=sys.stderr)
+        if not (warnings and strict):
+            yield login, password
+
+# Streams the file, encrypts it in chunks on the worker pool and commits each chunk at once
+def import_logins(session, path, fmt=None, workers=None, strict=False):
+    count = 0
+    file = open_text(path, 'r')
+    try:
+        entries = _checked_entries(read_entries(file, file_format(path, fmt)), session.breach_index, strict)
+        for chunk in map_chunks(_encrypt_chunk, entries, load_keys(), workers):
+            for login, encrypted_password in chunk:
+                session.writer.set(login, encrypted_password)
+            session.writer.flush()
+            count += len(chunk)
+    finally:
+        if file is not sys.stdin:
+            file.close()
+    return count
+
+def export_logins(session, path, fmt=None, workers=None):
+    count = 0
+    fmt = file_format(path, fmt)
+    file = open_text(path, 'w')
+    try:
+        if fmt == 'csv':
+            import csv
+            writer = csv.writer(file)
+            writer.writerow(['login', 'password'])
+        for chunk in map_chunks(_decrypt_chunk, session.passwords.items(), load_keys(), workers):
+            if fmt == 'csv':
+                writer.writerows(chunk)
+            else:
+                file.write(''.join(json.dumps({'login': login, 'password': password}) + '\n' for login, password in chunk))
+            count += len(chunk)
+    finally:
+        if file is not sys.stdout:
+            file.close()
+    return count
+
+# Import-time budget for the generate-only path, checked with python -X importtime
+STARTUP_BUDGET_MS = 75
+STARTUP_FORBIDDEN = ('cryptography', 'secrets', 'sqlite3', 'csv', 'concurrent.futures.process')
+
+def check_startup(budget_ms=STARTUP_BUDGET_MS):
+    import subprocess
+    command = [sys.executable, '-X', 'importtime', os.path.abspath(__file__), 'generate']
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    total_us = 0
+    top_level = []
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        total_us += int(self_us)
+        loaded.add(name.strip())
+        if not name.startswith('  '):
+            top_level.append((int(cumulative_us), name.strip()))
+
+    print(f"Import time for 'generate': {total_us / 1000:.1f} ms (budget {budget_ms} ms)")
+    for cumulative_us, name in sorted(top_level, reverse=True)[:5]:
+        print(f"  {cumulative_us / 1000:6.1f} ms  {name}")
+
+    problems = [f"{name} is imported" for name in STARTUP_FORBIDDEN if name in loaded]
+    if total_us / 1000 > budget_ms:
+        problems.append("over budget")
+    for problem in problems:
+        print(f"Error: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Password generator and encrypted vault. Runs the interactive menu without a command.")
+    parser.add_argument('--backend', choices=['json', 'sqlite'], help="vault storage (default: $PASSWORD_VAULT_BACKEND or json)")
+    parser.add_argument('--jsonl', action='store_true', help="read operations as JSON lines from stdin and write results to stdout")
+    parser.add_argument('--agent', action='store_true', help="send generate, set, get, delete, list and check to the running agent")
+    parser.add_argument('--socket', default=AGENT_SOCKET, help="agent socket (default: $PASSWORD_AGENT_SOCKET or password-agent.sock)")
+    commands = parser.add_subparsers(dest='command')
+
+    generate = commands.add_parser('generate', help="print new passwords")
+    generate.add_argument('-l', '--length', type=int, default=DEFAULT_LENGTH)
+    generate.add_argument('-n', '--count', type=int, default=1)
+
+    set_ = commands.add_parser('set', help="save a password (generated when none is given)")
+    set_.add_argument('login')
+    set_.add_argument('--stdin', action='store_true', help="read the password from stdin")
+    set_.add_argument('-l', '--length', type=int, default=DEFAULT_LENGTH)
+    set_.add_argument('--strict', action='store_true', help="refuse a breached or weak password instead of saving it with a warning")
+
+    get = commands.add_parser('get', help="print the password of a login")
+    get.add_argument('login')
+
+    delete = commands.add_parser('delete', help="delete a login")
+    delete.add_argument('login')
+
+    list_ = commands.add_parser('list', help="print logins")
+    list_.add_argument('--prefix', default='')
+    list_.add_argument('--search', help="match anywhere in the login")
+    list_.add_argument('--limit', type=int, default=PAGE_SIZE)
+    list_.add_argument('--offset', type=int, default=0)
+
+    import_ = commands.add_parser('import', help="import plaintext logins from CSV or JSON lines")
+    import_.add_argument('file', help="path, or - for stdin")
+    import_.add_argument('--strict', action='store_true', help="skip breached or weak passwords instead of importing them with a warning")
+
+    export = commands.add_parser('export', help="export plaintext logins as CSV or JSON lines")
+    export.add_argument('file', help="path, or - for stdout")
+
+    for command in (import_, export):
+        command.add_argument('--format', choices=['csv', 'jsonl'], help="default: csv for *.csv files, jsonl otherwise")
+        command.add_argument('--workers', type=int, help="encryption processes (default: all cores)")
+
+    commands.add_parser('rotate-key', help="re-encrypt the vault with a new key")
+
+    commands.add_parser('check', help="check a password read from stdin against the breach index and score it")
+
+    breach = commands.add_parser('build-breach-index', help="compile a list of SHA-1 hashes into a breach index")
+    breach.add_argument('hashes', help="text file, one hex SHA-1 per line")
+    breach.add_argument('-o', '--output', default=BREACH_INDEX)
+    breach.add_argument('--fp-rate', type=float, default=0.001, help="false positive rate")
+
+    commands.add_parser('agent', help="keep the key and the vault in memory and serve operations on --socket")
+
+    startup = commands.add_parser('check-startup', help="measure the import time of the generate command")
+    startup.add_argument('--budget', type=int, default=STARTUP_BUDGET_MS, help="milliseconds")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.jsonl and not args.command:
+        menu()
+        return 0
+    if args.command == 'check-startup':
+        return check_startup(args.budget)
+    if args.command == 'agent':
+        try:
+            return serve_agent(args.socket, args.backend)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+
+    session = Session(args.backend)
+    try:
+        if args.jsonl:
+            return 1 if run_jsonl(session) else 0
+
+        if args.command == 'import':
+            print(f"Imported {import_logins(session, args.file, args.format, args.workers, args.strict)} logins.", file=sys.stderr)
+        elif args.command == 'export':
+            print(f"Exported {export_logins(session, args.file, args.format, args.workers)} logins.", file=sys.stderr)
+        elif args.command == 'rotate-key':
+            rotate_key(session.passwords)
+        elif args.command == 'build-breach-index':
+            build_breach_index(args.hashes, args.output, args.fp_rate)
+        else:
+            request = {'op': args.command}
+            if args.command == 'generate':
+                request.update(count=args.count, length=args.length)
+            elif args.command == 'set':
+                request.update(login=args.login, length=args.length, strict=args.strict)
+                if args.stdin:
+                    request['password'] = sys.stdin.readline().rstrip('\n')
+            elif args.command == 'check':
+                request['password'] = sys.stdin.readline().rstrip('\n')
+            elif args.command == 'list':
+                request.update(prefix=args.prefix, limit=args.limit, offset=args.offset)
+                if args.search:
+                    request['search'] = args.search
+            else:
+                request['login'] = args.login
+
+            if args.agent:
+                try:
+                    result = agent_request(request, args.socket)
+                except (FileNotFoundError, ConnectionRefusedError):
+                    raise ValueError(f"no agent is listening on {args.socket}")
+                if not result.pop('ok'):
+                    raise ValueError(result['error'])
+            else:
+                result = run_operation(request, session)
+            for line in result.get('passwords') or result.get('logins') or []:
+                print(line)
+            if args.command in ('get', 'set') and 'password' in result:
+                print(result['password'])
+            if args.command == 'check':
+                print(f"Entropy: {result['entropy']} bits")
+            for warning in result.get('warnings', []):
+                print(f"Warning: {warning}", file=sys.stderr)
+    except KeyError as e:
+        print(f"Error: login not found: {e.args[0]}", file=sys.stderr)
+        return 1
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except _invalid_token():
+        print(f"Error: {decrypt_error(getattr(args, 'login', None))}", file=sys.stderr)
+        return 1
+    finally:
+        session.close()
+    return 0
+
 if __name__ == "__main__":
-    menu()
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# Benchmarks for password_generator.py
+# Runs on synthetic data in a temporary directory, writes the results as JSON and
+# compares them with a stored baseline, so storage or crypto changes can be judged on numbers.
+#
+#   python password_generator_benchmark.py                    # full run, 1k/100k/1M vaults
+#   python password_generator_benchmark.py --sizes 1000 10000 # quicker
+#   python password_generator_benchmark.py --save-baseline    # accept the current numbers
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import password_generator as pg
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+LENGTHS = [8, 16, 32, 64, 128]
+RESULTS_FILE = 'password_generator_bench.json'
+BASELINE_FILE = 'password_generator_baseline.json'
+TOLERANCE = 0.15 # Slower than the baseline by more than this is a regression
+
+
+# Time a function several times, the numbers are seconds per call
+def measure(function, repeat=5, number=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    times.sort()
+    return {
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+        'min': times[0],
+        'max': times[-1],
+        'repeat': repeat,
+        'number': number,
+    }
+
+# Random strings shaped like Fernet tokens, encrypting a million real ones would take longer than the benchmark
+def synthetic_vault(size):
+    token = base64.urlsafe_b64encode(os.urandom(72)).decode() # About the size of a short password's token
+    return {f"user{i:07d}@service{i % 97}.example.com": token[i % 64:] + token[:i % 64] for i in range(size)}
+
+def bench_generation(results, count):
+    for length in LENGTHS:
+        results[f'generate_password/{length}'] = measure(lambda: pg.generate_password(length), number=count)
+        results[f'generate_passwords/{length}'] = measure(lambda: list(pg.generate_passwords(count, length)))
+        results[f'generate_passwords/{length}']['per_item'] = count
+
+def bench_crypto(results, count):
+    from cryptography.fernet import Fernet
+    fernet = Fernet(Fernet.generate_key())
+    password = next(pg.generate_passwords(1, 16))
+    token = pg.encrypt_password(password, fernet)
+    results['encrypt_password'] = measure(lambda: pg.encrypt_password(password, fernet), number=count)
+    results['decrypt_password'] = measure(lambda: pg.decrypt_password(token, fernet), number=count)
+    cache = pg.DecryptionCache(fernet)
+    results['decryption_cache_hit'] = measure(lambda: cache.get('login', token), number=count)
+    return fernet
+
+def bench_vault(results, sizes, fernet, adds):
+    quiet = contextlib.redirect_stdout(io.StringIO()) # add_or_update_login prints every save
+    for size in sizes:
+        passwords = synthetic_vault(size)
+        repeat = 3 if size < 1_000_000 else 1
+
+        # JSON snapshot + journal
+        results[f'json/{size}/save_password'] = measure(lambda: pg.save_password(passwords), repeat)
+        results[f'json/{size}/load_password'] = measure(pg.load_password, repeat)
+        with quiet:
+            counter = iter(range(10 ** 9))
+            results[f'json/{size}/add_or_update_login'] = measure(
+                lambda: pg.add_or_update_login(passwords, f'new{next(counter)}', 'Benchmark#1', fernet), number=adds)
+        for path in (pg.VAULT_FILE, pg.JOURNAL_FILE):
+            if os.path.exists(path):
+                os.remove(path)
+
+        # SQLite
+        vault = pg.SqliteVault(pg.DB_FILE)
+        results[f'sqlite/{size}/bulk_insert'] = measure(lambda: vault.update_many(passwords.items()), 1)
+        login = next(iter(passwords))
+        results[f'sqlite/{size}/get'] = measure(lambda: vault[login], number=adds)
+        results[f'sqlite/{size}/find_prefix'] = measure(lambda: vault.find(login[:8]), number=adds)
+        with quiet:
+            counter = iter(range(10 ** 9))
+            results[f'sqlite/{size}/add_or_update_login'] = measure(
+                lambda: pg.add_or_update_login(vault, f'new{next(counter)}', 'Benchmark#1', fernet), number=adds)
+        vault.close()
+        for path in (pg.DB_FILE, pg.DB_FILE + '-wal', pg.DB_FILE + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+        del passwords
+
+# Compare the best sample of each benchmark (the least noisy number) with the baseline,
+# returns the names that got slower than the tolerance allows
+def compare(results, baseline, tolerance=TOLERANCE):
+    regressions = []
+    print(f"\n{'benchmark':45} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['min']
+        ratio = current['min'] / before if before else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:45} {before * 1e6:10.1f}us {current['min'] * 1e6:10.1f}us {ratio:7.2f}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark password_generator.py on synthetic data.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="vault sizes")
+    parser.add_argument('--count', type=int, default=2000, help="calls per sample for the small operations")
+    parser.add_argument('--adds', type=int, default=200, help="add_or_update_login calls per sample")
+    parser.add_argument('--output', default=RESULTS_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir) # The vault files use relative paths
+        try:
+            bench_generation(results, args.count)
+            fernet = bench_crypto(results, args.count)
+            bench_vault(results, args.sizes, fernet, args.adds)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'sizes': args.sizes,
+        },
+        'results': results,
+    }
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=4)
+    print(f"Results written to {output}")
+
+    if args.save_baseline or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as file:
+            json.dump(report, file, indent=4)
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}.")
+        return 1
+    print("\nNo regressions.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
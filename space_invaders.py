@@ -1,15 +1,23 @@
 import pygame
+import numpy as np
 import random
 import math
 import sys
-
-pygame.init()
+import os
+import time
+import argparse
+from collections import defaultdict, OrderedDict, deque
+from itertools import repeat
+from operator import itemgetter
+from bisect import bisect_left
+import csv
+import json
+import hashlib
 
 # Screen
 WIDTH = 800
 HEIGHT = 600
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Space Invaders")
+screen = None
 
 # Colors
 WHITE = (255, 255, 255)
@@ -27,10 +35,91 @@ PAUSED = "paused"
 GAME_OVER = "game_over"
 
 # Fonts
-default_font = pygame.font.Font(None, 36)
+default_font = None
+
+# Rendered text surfaces, keyed by (text, color, font). Text only has to be rasterized
+# again when it changes: the HUD timers once a second, the round and level rarely.
+class TextCache:
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text, color=WHITE, font=None):
+        font = font or default_font
+        key = (text, color, font)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+text_cache = TextCache()
+
+# The menu, pause and game over screens never change: lines of (text, y offset from the middle)
+STATIC_SCREENS = {
+    MENU: [("Space Invaders", -100), ("Press ENTER to Start", 0), ("Press Q to Exit", 50)],
+    PAUSED: [("Paused", -50), ("Press ESC to Resume", 0), ("Press X to Exit Round", 50)],
+    GAME_OVER: [("You've Lost", -100), ("Press R to Try Again", 0), ("Press Q to Exit", 50)],
+}
+static_screens = {}
+
+# Render the static screens once, as (surface, position) pairs ready to blit
+def prerender_screens():
+    for state, lines in STATIC_SCREENS.items():
+        static_screens[state] = []
+        for text, offset in lines:
+            surface = default_font.render(text, True, WHITE)
+            static_screens[state].append((surface, (WIDTH // 2 - surface.get_width() // 2, HEIGHT // 2 + offset)))
+
+# Every entity is a plain colored rectangle: one pre-built surface per kind, keyed by
+# name (enemies and power-ups by their type), so a frame is drawn with a few blits calls
+SPRITE_SHAPES = {
+    "player": (50, 40, GREEN),
+    "normal": (40, 30, RED),
+    "sine": (40, 30, YELLOW),
+    "player_bullet": (5, 15, YELLOW),
+    "enemy_bullet": (5, 15, RED),
+    "speed": (20, 20, BLUE),
+    "bullets": (20, 20, PURPLE),
+    "boss": (100, 80, RED),
+}
+sprites = {}
+bullet_sprites = np.empty(2, object) # Indexed by BulletSystem.player
+
+def build_sprites():
+    for kind, (width, height, color) in SPRITE_SHAPES.items():
+        sprite = pygame.Surface((width, height)).convert() # Same pixel format as the screen, the fastest to blit
+        sprite.fill(color)
+        sprites[kind] = sprite
+    bullet_sprites[0] = sprites["enemy_bullet"]
+    bullet_sprites[1] = sprites["player_bullet"]
+
+# Open the window, or a dummy one that is never shown when running headless
+def init_display(headless=False):
+    global screen, default_font
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Space Invaders")
+    default_font = pygame.font.Font(None, 36)
+    prerender_screens()
+    build_sprites()
 
 # Player 
 class Player:
+    __slots__ = ("width", "height", "x", "y", "color", "base_speed", "speed", "rect",
+                 "base_max_bullets", "max_bullets", "speed_timer", "bullet_timer")
+
     def __init__(self):
         self.width = 50
         self.height = 40
@@ -75,12 +164,16 @@ class Player:
             if self.bullet_timer <= 0:
                 self.max_bullets = self.base_max_bullets
 
-    def draw(self):
-        pygame.draw.rect(screen, GREEN, self.rect)
-
 # Enemies
 class Enemy:
-    def __init__(self, x, y, type_="normal"):
+    __slots__ = ("width", "height", "x", "y", "type", "speed", "health", "rect", "shoot_timer", "sine_offset")
+
+    def __init__(self, x, y, type_="normal", rng=random):
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.reset(x, y, type_, rng)
+
+    # Also used to recycle a pooled enemy
+    def reset(self, x, y, type_="normal", rng=random):
         self.width = 40
         self.height = 30
         self.x = x
@@ -88,9 +181,9 @@ class Enemy:
         self.type = type_
         self.speed = 2
         self.health = 1 if type_ != "normal" else 2
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
-        self.shoot_timer = random.randint(60, 180)  # Shots every 1-3 seconds
-        self.sine_offset = random.uniform(0, 2 * math.pi)
+        self.rect.update(self.x, self.y, self.width, self.height)
+        self.shoot_timer = rng.randint(60, 180)  # Shots every 1-3 seconds
+        self.sine_offset = rng.uniform(0, 2 * math.pi)
 
     def move(self, frame_count):
         if self.type == "normal":
@@ -100,32 +193,121 @@ class Enemy:
             self.y = 50 + math.sin(frame_count * 0.05 + self.sine_offset) * 50
         self.rect.topleft = (self.x, self.y)
 
-    def draw(self):
-        color = YELLOW if self.type == "sine" else RED
-        pygame.draw.rect(screen, color, self.rect)
+# Bullets, stored as a struct of arrays so movement, culling and hit tests are vectorized.
+# Velocity is worked out once when a bullet is fired; a bullet with negative speed is the player's.
+BULLET_WIDTH = 5
+BULLET_HEIGHT = 15
 
-# Bullets
-class Bullet:
-    def __init__(self, x, y, angle=0, speed=-10):
-        self.width = 5
-        self.height = 15
-        self.x = x
-        self.y = y
-        self.speed = speed
-        self.angle = angle
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+# pygame.Rect rounds float positions half away from zero when they're assigned
+def _rect_round(values, out):
+    rounded = np.abs(values)
+    rounded += 0.5
+    np.floor(rounded, out=rounded)
+    np.copysign(rounded, values, out=rounded)
+    out[:] = rounded
+
+class BulletSystem:
+    def __init__(self, capacity=256):
+        self.count = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        old = getattr(self, "x", None)
+        arrays = {
+            "x": np.float64, "y": np.float64,    # Exact position
+            "vx": np.float64, "vy": np.float64,  # Movement per frame
+            "rx": np.int64, "ry": np.int64,      # Top left of the rect, as pygame would store it
+            "player": np.bool_,                  # Fired by the player
+        }
+        for name, dtype in arrays.items():
+            array = np.zeros(capacity, dtype)
+            if old is not None:
+                array[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, array)
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, x, y, angle=0, speed=-10):
+        if self.count == len(self.x):
+            self._allocate(len(self.x) * 2)
+        i = self.count
+        self.x[i] = x
+        self.y[i] = y
+        self.vy[i] = speed * math.cos(math.radians(angle))
+        self.vx[i] = speed * math.sin(math.radians(angle))
+        self.rx[i] = int(x) # pygame.Rect() truncates, it only rounds once the bullet moves
+        self.ry[i] = int(y)
+        self.player[i] = speed < 0
+        self.count += 1
+
+    def player_count(self):
+        return int(np.count_nonzero(self.player[:self.count]))
 
     def move(self):
-        self.y += self.speed * math.cos(math.radians(self.angle))
-        self.x += self.speed * math.sin(math.radians(self.angle))
-        self.rect.topleft = (self.x, self.y)
+        n = self.count
+        if n:
+            self.x[:n] += self.vx[:n]
+            self.y[:n] += self.vy[:n]
+            _rect_round(self.x[:n], self.rx[:n])
+            _rect_round(self.y[:n], self.ry[:n])
+
+    # Drop the bullets that left the screen
+    def cull(self):
+        n = self.count
+        if n:
+            x, y = self.x[:n], self.y[:n]
+            self.keep((x >= 0) & (x <= WIDTH) & (y >= 0) & (y <= HEIGHT))
+
+    # Pack the kept bullets at the front of the arrays, in firing order
+    def keep(self, mask):
+        n = self.count
+        kept = int(np.count_nonzero(mask))
+        if kept == n:
+            return
+        for array in (self.x, self.y, self.vx, self.vy, self.rx, self.ry, self.player):
+            array[:kept] = array[:n][mask]
+        self.count = kept
+
+    def remove(self, indexes):
+        mask = np.ones(self.count, np.bool_)
+        mask[list(indexes)] = False
+        self.keep(mask)
+
+    # Mask of the bullets whose rect overlaps rect, same rule as Rect.colliderect
+    def overlaps(self, rect):
+        n = self.count
+        rx, ry = self.rx[:n], self.ry[:n]
+        return ((rx < rect.right) & (rect.left < rx + BULLET_WIDTH)
+                & (ry < rect.bottom) & (rect.top < ry + BULLET_HEIGHT))
 
-    def draw(self):
-        pygame.draw.rect(screen, YELLOW if self.speed < 0 else RED, self.rect)
+    # (index, left, top) of the player's bullets, in index order
+    def player_bullets(self):
+        if not self.count:
+            return []
+        indexes = np.flatnonzero(self.player[:self.count])
+        return list(zip(indexes.tolist(), self.rx[indexes].tolist(), self.ry[indexes].tolist()))
+
+    # (sprite, position) pairs for Surface.blits. With alpha below 1 the bullets are drawn that
+    # fraction of the way from their previous position, which is one step back along their velocity
+    def blit_pairs(self, alpha=1.0):
+        n = self.count
+        if alpha >= 1.0:
+            left, top = self.rx[:n], self.ry[:n]
+        else:
+            left, top = np.empty(n, np.int64), np.empty(n, np.int64)
+            _rect_round(self.x[:n] - self.vx[:n] * (1.0 - alpha), left)
+            _rect_round(self.y[:n] - self.vy[:n] * (1.0 - alpha), top)
+        # Picking the sprites and pairing them up in numpy and zip keeps the Python loop out of it
+        kinds = bullet_sprites[self.player[:n].view(np.uint8)].tolist()
+        return zip(kinds, zip(left.tolist(), top.tolist()))
 
 # Boss
 class Boss:
-    def __init__(self, round_num):
+    __slots__ = ("width", "height", "x", "y", "speed", "health", "rect",
+                 "shoot_timer", "attack_type", "special_timer", "spawn_timer")
+
+    def __init__(self, round_num, rng=random):
         self.width = 100
         self.height = 80
         self.x = WIDTH // 2 - self.width // 2
@@ -134,7 +316,7 @@ class Boss:
         # Health, starts at 100 and goes up by 25% every 5 rounds
         self.health = int(100 * (1.25 ** ((round_num // 5) - 1))) if round_num >= 5 else 100
         self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
-        self.shoot_timer = random.randint(60, 120)  # Shots every 1-2 seconds
+        self.shoot_timer = rng.randint(60, 120)  # Shots every 1-2 seconds
         self.attack_type = 0
         self.special_timer = 300
         self.spawn_timer = 600
@@ -145,69 +327,133 @@ class Boss:
             self.speed *= -1
         self.rect.topleft = (self.x, self.y)
 
-    def draw(self):
-        pygame.draw.rect(screen, RED, self.rect)
-        pygame.draw.rect(screen, GREEN, (self.x, self.y - 20, self.health, 10))
-
 # Power Ups
 class PowerUp:
+    __slots__ = ("width", "height", "x", "y", "speed", "type", "rect")
+
     def __init__(self, x, y, type_):
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.reset(x, y, type_)
+
+    # Also used to recycle a pooled power-up
+    def reset(self, x, y, type_):
         self.width = 20
         self.height = 20
         self.x = x
         self.y = y
         self.speed = 2
         self.type = type_  # "speed" or "bullets"
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+        self.rect.update(self.x, self.y, self.width, self.height)
 
     def move(self):
         self.y += self.speed
         self.rect.topleft = (self.x, self.y)
 
-    def draw(self):
-        color = BLUE if self.type == "speed" else PURPLE
-        pygame.draw.rect(screen, color, self.rect)
+# Entity pools: enemies and power-ups are recycled instead of created for every wave and drop.
+# (Bullets live in BulletSystem's preallocated arrays, which already work as a pool.)
+class Pool:
+    def __init__(self, cls, size):
+        self.cls = cls
+        self.free = [self._blank() for _ in range(size)]
+        self.created = size
+        self.acquired = 0
+        self.reused = 0
+
+    def _blank(self):
+        entity = self.cls.__new__(self.cls) # Filled in by reset(), no random numbers drawn here
+        entity.rect = pygame.Rect(0, 0, 0, 0)
+        return entity
+
+    def acquire(self, *args):
+        self.acquired += 1
+        if self.free:
+            entity = self.free.pop()
+            self.reused += 1
+        else:
+            entity = self._blank()
+            self.created += 1
+        entity.reset(*args)
+        return entity
+
+    def release(self, entity):
+        self.free.append(entity)
+
+    def stats(self):
+        return {
+            "size": self.created,
+            "free": len(self.free),
+            "acquired": self.acquired,
+            "hit_rate": self.reused / self.acquired if self.acquired else 1.0,
+        }
+
+enemy_pool = Pool(Enemy, 64)
+power_up_pool = Pool(PowerUp, 32)
+
+# Remove the entities in drop from the list in place and give them back to the pool
+def release_from(entities, drop, pool):
+    kept = 0
+    for entity in entities:
+        if entity in drop:
+            pool.release(entity)
+        else:
+            entities[kept] = entity
+            kept += 1
+    del entities[kept:]
+
+# A fresh row of enemies, replacing whatever is left in the list
+def spawn_wave(enemies, rng):
+    for enemy in enemies:
+        enemy_pool.release(enemy)
+    enemies.clear()
+    for x in range(50, WIDTH - 50, 60):
+        type_ = rng.choice(["normal", "sine"])
+        enemies.append(enemy_pool.acquire(x, 50, type_, rng))
 
 # Player attacks
 def shoots_bullets_player(player, bullets):
-    player_bullets = len([b for b in bullets if b.speed < 0])
+    player_bullets = bullets.player_count()
     if player_bullets < player.max_bullets:
         if player.max_bullets == 2:
-            bullets.append(Bullet(player.x + player.width // 2 - 2.5, player.y))
+            bullets.spawn(player.x + player.width // 2 - 2.5, player.y)
         else:
             for i in range(player.max_bullets):
                 angle = -30 + (60 / (player.max_bullets - 1)) * i
-                bullets.append(Bullet(player.x + player.width // 2 - 2.5, player.y, angle))
+                bullets.spawn(player.x + player.width // 2 - 2.5, player.y, angle)
 
 # Enemy attacks
 def shoots_bullets_enemy(enemy, bullets):
     if enemy.type == "sine":
         for angle in [-15, 0, 15]:
-            bullets.append(Bullet(enemy.x + enemy.width // 2 - 2.5, enemy.y + enemy.height, angle=angle, speed=5))
+            bullets.spawn(enemy.x + enemy.width // 2 - 2.5, enemy.y + enemy.height, angle=angle, speed=5)
     else:
-        bullets.append(Bullet(enemy.x + enemy.width // 2 - 2.5, enemy.y + enemy.height, speed=5))
+        bullets.spawn(enemy.x + enemy.width // 2 - 2.5, enemy.y + enemy.height, speed=5)
 
 # Boss attacks
-def shoots_bullets_boss(boss, bullets):
+def shoots_bullets_boss(boss, bullets, rng):
     if boss.attack_type == 0:
-        bullets.append(Bullet(boss.x + boss.width // 2 - 2.5, boss.y + boss.height, speed=5))
+        bullets.spawn(boss.x + boss.width // 2 - 2.5, boss.y + boss.height, speed=5)
     elif boss.attack_type == 1:
         for angle in [-40, -20, 0, 20, 40]:
-            bullets.append(Bullet(boss.x + boss.width // 2 - 2.5, boss.y + boss.height, angle=angle, speed=6))
+            bullets.spawn(boss.x + boss.width // 2 - 2.5, boss.y + boss.height, angle=angle, speed=6)
     elif boss.attack_type == 2:
         for offset in [-20, 0, 20]:
-            bullets.append(Bullet(boss.x + boss.width // 2 - 2.5 + offset, boss.y + boss.height, speed=8))
+            bullets.spawn(boss.x + boss.width // 2 - 2.5 + offset, boss.y + boss.height, speed=8)
     elif boss.attack_type == 3:
         for _ in range(10):
-            x = random.randint(boss.x, boss.x + boss.width)
-            bullets.append(Bullet(x, boss.y + boss.height, speed=random.uniform(5, 7)))
+            x = rng.randint(boss.x, boss.x + boss.width)
+            bullets.spawn(x, boss.y + boss.height, speed=rng.uniform(5, 7))
 
 # Reset game
-def reset_game():
+def reset_game(rng, enemies=None, power_ups=None):
     player = Player()
-    enemies = [Enemy(x, 50, random.choice(["normal", "sine"])) for x in range(50, WIDTH - 50, 60)]
-    bullets = []
-    power_ups = []
+    # Reuse the lists of the game that ended, their entities go back to the pools
+    enemies = enemies if enemies is not None else []
+    spawn_wave(enemies, rng)
+    bullets = BulletSystem()
+    power_ups = power_ups if power_ups is not None else []
+    for power_up in power_ups:
+        power_up_pool.release(power_up)
+    power_ups.clear()
     boss = None
     round_num = 1
     level = 1
@@ -215,48 +461,440 @@ def reset_game():
     enemy_move_down = False
     return player, enemies, bullets, power_ups, boss, round_num, level, enemy_direction, enemy_move_down
 
-# Initialization
-player, enemies, bullets, power_ups, boss, round_num, level, enemy_direction, enemy_move_down = reset_game()
-game_state = MENU
-frame_count = 0
+# Dirty-rectangle rendering for software-rendered machines: instead of clearing and
+# pushing all 800x600 pixels, erase where things were last frame, draw them where
+# they are now and send only those areas to the display
+DIRTY_RECT_LIMIT = 400 # More changed areas than this and a full flip is cheaper
+
+class DirtyRenderer:
+    def __init__(self, surface, limit=DIRTY_RECT_LIMIT):
+        self.surface = surface
+        self.limit = limit
+        self.previous = []
+        self.state = None
+        self.full_redraw = True
+
+    # Erase last frame's drawing, returns False when nothing on screen needs drawing
+    def begin(self, game_state):
+        if game_state != self.state:
+            self.state = game_state
+            self.full_redraw = True
+        if self.full_redraw or len(self.previous) > self.limit:
+            self.surface.fill(BLACK)
+        else:
+            for rect in self.previous:
+                self.surface.fill(BLACK, rect)
+        return self.full_redraw or game_state == PLAYING
+
+    def finish(self, drawn):
+        if self.full_redraw or len(self.previous) + len(drawn) > self.limit:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.previous + drawn)
+        self.previous = drawn
+        self.full_redraw = False
+
+# Per-phase frame profiler. run_game only calls it when one is given (or F3 turns it on),
+# so with it off the loop pays nothing but a few "if profiler" checks.
+PROFILE_PHASES = ("events", "player", "rounds", "enemies", "boss", "bullets", "power_ups", "render", "flip")
+
+class FrameProfiler:
+    def __init__(self, window=120, output=None, overlay=False):
+        self.frame_times = deque(maxlen=window) # Rolling window for the overlay
+        self.totals = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.frames = 0
+        # One row per frame goes to output (CSV, or JSON when it ends in .json) as the frame
+        # ends, so a long run doesn't pile them up in memory
+        self.output = output
+        self.file = None
+        self.writer = None
+        self.rows = 0
+        self.overlay = overlay
+        self.overlay_lines = []
+        self.font = None
+        self.current = {}
+        self.frame_start = self.last = 0.0
+
+    def start(self):
+        self.frame_start = self.last = time.perf_counter()
+        self.current = dict.fromkeys(PROFILE_PHASES, 0.0)
+
+    # Time since the previous mark goes to phase
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    def end(self, frame, counts):
+        total = time.perf_counter() - self.frame_start
+        self.frame_times.append(total)
+        self.frames += 1
+        for phase, seconds in self.current.items():
+            self.totals[phase] += seconds
+        if self.output:
+            row = {"frame": frame, "total_us": round(total * 1e6, 1)}
+            row.update((f"{phase}_us", round(seconds * 1e6, 1)) for phase, seconds in self.current.items())
+            row.update(counts)
+            self.write(row)
+
+    def percentiles(self):
+        times = sorted(self.frame_times)
+        if not times:
+            return 0.0, 0.0
+        return times[len(times) // 2], times[min(len(times) - 1, int(len(times) * 0.99))]
+
+    # Top right corner, the text is only re-rendered a few times a second
+    def draw(self, surface, frame, counts):
+        if frame % 15 == 0 or not self.overlay_lines:
+            if self.font is None:
+                self.font = pygame.font.Font(None, 20)
+            p50, p99 = self.percentiles()
+            lines = [f"frame p50 {p50 * 1000:.2f} ms  p99 {p99 * 1000:.2f} ms"]
+            lines += [f"{phase}: {seconds * 1e6:.0f} us" for phase, seconds in self.current.items()]
+            lines.append("  ".join(f"{name}: {count}" for name, count in counts.items()))
+            self.overlay_lines = [self.font.render(line, True, WHITE, BLACK) for line in lines]
+        return [surface.blit(line, (WIDTH - line.get_width() - 10, 10 + i * 16))
+                for i, line in enumerate(self.overlay_lines)]
+
+    def summary(self):
+        p50, p99 = self.percentiles()
+        means = ", ".join(f"{phase} {total / max(self.frames, 1) * 1e6:.0f}us" for phase, total in self.totals.items())
+        return f"Frame time p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms (last {len(self.frame_times)} frames)\nMean per phase: {means}"
+
+    def write(self, row):
+        if self.file is None:
+            self.file = open(self.output, "w", newline="")
+            if not self.output.endswith(".json"):
+                self.writer = csv.DictWriter(self.file, fieldnames=list(row))
+                self.writer.writeheader()
+        if self.writer:
+            self.writer.writerow(row)
+        else:
+            self.file.write(("[" if not self.rows else ",\n") + json.dumps(row))
+        self.rows += 1
+
+    # Finishes the output file, which is still created when no frame was timed
+    def close(self):
+        if self.output and self.file is None:
+            self.file = open(self.output, "w", newline="")
+        if self.file:
+            if self.output.endswith(".json"):
+                self.file.write("]\n" if self.rows else "[]\n")
+            self.file.close()
+            self.file = None
+
+# Input providers: events() returns this frame's pygame events, pressed() the keys held down
+
+# Live keyboard
+class KeyboardInput:
+    def events(self, game_state):
+        return pygame.event.get()
+
+    def pressed(self):
+        return pygame.key.get_pressed()
+
+# A random player for headless runs: starts the game, wanders, shoots, restarts when it loses
+class RandomInput:
+    def __init__(self, seed=None, restart=True):
+        self.random = random.Random(seed)
+        self.restart = restart
+        self.held = defaultdict(bool)
+        self.hold_frames = 0
+
+    def events(self, game_state):
+        keys = []
+        if game_state == MENU:
+            keys.append(pygame.K_RETURN)
+        elif game_state == GAME_OVER:
+            keys.append(pygame.K_r if self.restart else pygame.K_q)
+        elif game_state == PLAYING and self.random.random() < 0.1:
+            keys.append(pygame.K_SPACE)
+        return [pygame.event.Event(pygame.KEYDOWN, key=key) for key in keys]
+
+    def pressed(self):
+        # Keep a direction for a while, like a person would
+        if self.hold_frames <= 0:
+            self.held = defaultdict(bool)
+            self.held[self.random.choice([pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN, None])] = True
+            self.hold_frames = self.random.randint(10, 60)
+        self.hold_frames -= 1
+        return self.held
+
+# A simple scripted player for batch runs: dodges enemy bullets that are about to reach it,
+# otherwise stays under the lowest enemy (or the boss) and fires whenever it can.
+# It reads the game directly, which a real player's eyes would do.
+DODGE_DISTANCE = 150 # How far above the player an enemy bullet counts as a threat
+
+class ScriptedInput:
+    def __init__(self, game, restart=False):
+        self.game = game
+        self.restart = restart
+        self.held = defaultdict(bool)
+
+    def target(self):
+        game = self.game
+        if game.boss:
+            return game.boss.rect.centerx
+        if game.enemies:
+            return max(game.enemies, key=lambda enemy: enemy.y).rect.centerx
+        return None
+
+    # Centre of the enemy bullets about to hit the player, or None
+    def threat(self):
+        bullets = self.game.bullets
+        rect = self.game.player.rect
+        n = len(bullets)
+        if not n:
+            return None
+        x, y = bullets.rx[:n], bullets.ry[:n]
+        near = (~bullets.player[:n] & (x + BULLET_WIDTH > rect.left - 10) & (x < rect.right + 10)
+                & (y + BULLET_HEIGHT > rect.top - DODGE_DISTANCE) & (y < rect.bottom))
+        if not near.any():
+            return None
+        return float(x[near].mean()) + BULLET_WIDTH / 2
+
+    def events(self, game_state):
+        if game_state == MENU:
+            return [pygame.event.Event(pygame.KEYDOWN, key=pygame.K_RETURN)]
+        if game_state == GAME_OVER:
+            return [pygame.event.Event(pygame.KEYDOWN, key=pygame.K_r if self.restart else pygame.K_q)]
+        game = self.game
+        target = self.target()
+        if (game_state == PLAYING and target is not None and abs(target - game.player.rect.centerx) < 20
+                and game.bullets.player_count() < game.player.max_bullets):
+            return [pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE)]
+        return []
 
-clock = pygame.time.Clock()
-running = True
+    def pressed(self):
+        self.held = defaultdict(bool)
+        player = self.game.player
+        threat = self.threat()
+        if threat is not None:
+            # Away from the bullets, unless that's into a wall
+            left = threat > player.rect.centerx
+            if left and player.x <= 0 or not left and player.x >= WIDTH - player.width:
+                left = not left
+            self.held[pygame.K_LEFT if left else pygame.K_RIGHT] = True
+            return self.held
+        target = self.target()
+        if target is not None:
+            offset = target - player.rect.centerx
+            if offset < -player.speed:
+                self.held[pygame.K_LEFT] = True
+            elif offset > player.speed:
+                self.held[pygame.K_RIGHT] = True
+        return self.held
 
-# Game loop
-while running:
-    for event in pygame.event.get():
+# Random input gets a seed of its own, derived from the game's, so the two don't draw the
+# same numbers
+def input_seed(seed):
+    return None if seed is None else f"input-{seed}"
+
+# Player policies for run_batch, called with the game's seed and the game
+POLICIES = {
+    "random": lambda seed, game: RandomInput(input_seed(seed), restart=False),
+    "scripted": lambda seed, game: ScriptedInput(game),
+}
+
+# Record and replay. A recording is the seed plus the inputs, stored as JSON with one entry
+# per frame where something changed: [frame, held keys, pressed keys]. Held keys are a
+# bit mask over MOVE_KEYS, a QUIT event is stored as key 0.
+REPLAY_VERSION = 1
+MOVE_KEYS = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN, pygame.K_a, pygame.K_d, pygame.K_w, pygame.K_s)
+
+# Wraps another input provider and logs what it returned
+class RecordingInput:
+    def __init__(self, provider):
+        self.provider = provider
+        self.frame = -1
+        self.held = 0
+        self.inputs = []
+
+    def _entry(self):
+        if not self.inputs or self.inputs[-1][0] != self.frame:
+            self.inputs.append([self.frame, self.held, []])
+        return self.inputs[-1]
+
+    def events(self, game_state):
+        self.frame += 1
+        events = self.provider.events(game_state)
+        for event in events:
+            if event.type == pygame.QUIT:
+                self._entry()[2].append(0)
+            elif event.type == pygame.KEYDOWN:
+                self._entry()[2].append(event.key)
+        return events
+
+    def pressed(self):
+        keys = self.provider.pressed()
+        held = 0
+        for bit, key in enumerate(MOVE_KEYS):
+            if keys[key]:
+                held |= 1 << bit
+        if held != self.held:
+            self.held = held
+            self._entry()[1] = held
+        return keys
+
+    def save(self, path, seed, stats):
+        with open(path, "w") as file:
+            json.dump({
+                "version": REPLAY_VERSION,
+                "seed": seed,
+                "frames": stats["frames"],
+                "checksum": stats["checksum"],
+                "inputs": self.inputs,
+            }, file, separators=(",", ":"))
+
+def load_recording(path):
+    with open(path, "r") as file:
+        recording = json.load(file)
+    if recording.get("version") != REPLAY_VERSION:
+        raise ValueError(f"{path}: unsupported recording version {recording.get('version')}")
+    return recording
+
+# Plays a recording back, frame by frame
+class ReplayInput:
+    def __init__(self, recording, window=False):
+        self.inputs = recording["inputs"]
+        self.window = window
+        self.stopped = False # Closed before the end of the recording
+        self.next = 0
+        self.frame = -1
+        self.held = defaultdict(bool)
+
+    def events(self, game_state):
+        self.frame += 1
+        events = []
+        if self.window:
+            # The real queue still has to be drained for the window to respond. Only a QUIT
+            # (closing the window, or SIGINT/SIGTERM, which SDL turns into one) gets through
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.stopped = True
+                    events.append(event)
+        if self.next >= len(self.inputs) or self.inputs[self.next][0] != self.frame:
+            return events
+        _, held, keys = self.inputs[self.next]
+        self.next += 1
+        self.held = defaultdict(bool, ((key, True) for bit, key in enumerate(MOVE_KEYS) if held >> bit & 1))
+        events.extend(pygame.event.Event(pygame.QUIT) if key == 0 else pygame.event.Event(pygame.KEYDOWN, key=key)
+                      for key in keys)
+        return events
+
+    def pressed(self):
+        return self.held
+
+# Fixed timestep: the game always updates 60 times per simulated second, however fast it renders.
+# All the timers count updates (speed_timer = 1200 is 20 seconds), so this keeps them honest.
+STEP = 1 / 60
+MAX_STEPS_PER_FRAME = 5 # After a longer stall the game slows down instead of fast-forwarding
+FPS = 60
+TELEPORT_DISTANCE = 50 # Moves longer than this in one update (respawns, recycled entities) aren't interpolated
+
+# The game state and rules, without a window or a clock: step() advances one update,
+# render() draws the current state onto any surface.
+class Game:
+    def __init__(self, seed=None, profiler=None, interpolate=False):
+        # All the game's randomness comes from one generator seeded with seed, so the same
+        # seed and the same inputs always play out the same way
+        self.rng = random.Random(seed)
+        self.profiler = profiler
+        self.interpolate = interpolate # Keep the previous positions for render()
+        self.previous = {}
+        self.enemies = None
+        self.power_ups = None
+        self.reset()
+        self.state = MENU
+        self.frame_count = 0
+        self.games = 1
+        self.running = True
+
+    def reset(self):
+        (self.player, self.enemies, self.bullets, self.power_ups, self.boss, self.round_num,
+         self.level, self.enemy_direction, self.enemy_move_down) = reset_game(self.rng, self.enemies, self.power_ups)
+        self.previous = {}
+        # Per game statistics for run_batch
+        self.shots = 0
+        self.boss_spawned = 0
+        self.boss_kill_times = [] # Updates from each boss appearing to its death
+
+    # One update. inputs is an input provider, its keys are only read while playing
+    def step(self, inputs):
+        if self.interpolate:
+            self.previous = {entity: (entity.x, entity.y) for entity in self.entities()}
+        for event in inputs.events(self.state):
+            self.handle_event(event)
+        profiler = self.profiler
+        if profiler:
+            profiler.mark("events")
+
+        if self.state == PLAYING:
+            self.move_player(inputs.pressed())
+            if profiler:
+                profiler.mark("player")
+            self.update_round()
+            if profiler:
+                profiler.mark("rounds")
+            self.update_enemies()
+            if profiler:
+                profiler.mark("enemies")
+            self.update_boss()
+            if profiler:
+                profiler.mark("boss")
+            self.update_bullets()
+            if profiler:
+                profiler.mark("bullets")
+            self.update_power_ups()
+        if profiler:
+            profiler.mark("power_ups")
+        self.frame_count += 1
+
+    def handle_event(self, event):
+        state = self.state
         if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
-            if game_state == PLAYING:
-                if event.key == pygame.K_SPACE:
-                    shoots_bullets_player(player, bullets)
-                elif event.key == pygame.K_ESCAPE:
-                    game_state = PAUSED
-
-            # Game paused
-            elif game_state == PAUSED and event.key == pygame.K_ESCAPE:
-                game_state = PLAYING
-            elif game_state == PAUSED and event.key == pygame.K_x:
-                running = False
-
-            # Menu
-            elif game_state == MENU and event.key == pygame.K_RETURN:
-                game_state = PLAYING
-            elif game_state == MENU and event.key == pygame.K_q:
-                running = False
-
-            # Game Over
-            elif game_state == GAME_OVER and event.key == pygame.K_r:
-                player, enemies, bullets, power_ups, boss, round_num, level, enemy_direction, enemy_move_down = reset_game()
-                game_state = PLAYING
-            elif game_state == GAME_OVER and event.key == pygame.K_q:
-                running = False
+            self.running = False
+        elif event.type != pygame.KEYDOWN:
+            return
+
+        # Profiler overlay, available in every state
+        elif event.key == pygame.K_F3:
+            if self.profiler is None:
+                self.profiler = FrameProfiler()
+                self.profiler.start()
+            self.profiler.overlay = not self.profiler.overlay
+
+        elif state == PLAYING:
+            if event.key == pygame.K_SPACE:
+                count = len(self.bullets)
+                shoots_bullets_player(self.player, self.bullets)
+                self.shots += len(self.bullets) - count
+            elif event.key == pygame.K_ESCAPE:
+                self.state = PAUSED
+
+        # Game paused
+        elif state == PAUSED and event.key == pygame.K_ESCAPE:
+            self.state = PLAYING
+        elif state == PAUSED and event.key == pygame.K_x:
+            self.running = False
+
+        # Menu
+        elif state == MENU and event.key == pygame.K_RETURN:
+            self.state = PLAYING
+        elif state == MENU and event.key == pygame.K_q:
+            self.running = False
+
+        # Game Over
+        elif state == GAME_OVER and event.key == pygame.K_r:
+            self.reset()
+            self.state = PLAYING
+            self.games += 1
+        elif state == GAME_OVER and event.key == pygame.K_q:
+            self.running = False
 
     # Player movements
-    if game_state == PLAYING:
-        keys = pygame.key.get_pressed()
+    def move_player(self, keys):
+        player = self.player
         dx = 0
         dy = 0
         if keys[pygame.K_LEFT] or keys[pygame.K_a]:
@@ -272,159 +910,444 @@ while running:
         # Update timers
         player.update_timers()
 
-        # Rounds logic
-        if not enemies and not boss and not power_ups and round_num % 5 != 0:
-            round_num += 1
-            if round_num % 5 == 0:
-                level += 1
-                boss = Boss(round_num)
+    # Rounds logic
+    def update_round(self):
+        if not self.enemies and not self.boss and not self.power_ups and self.round_num % 5 != 0:
+            self.round_num += 1
+            if self.round_num % 5 == 0:
+                self.level += 1
+                self.boss = Boss(self.round_num, self.rng)
+                self.boss_spawned = self.frame_count
             else:
-                enemies = [Enemy(x, 50, random.choice(["normal", "sine"])) for x in range(50, WIDTH - 50, 60)]
+                spawn_wave(self.enemies, self.rng)
 
-        # Movement and shooting of enemies
-        for enemy in enemies[:]:
-            enemy.move(frame_count)
+    # Movement and shooting of enemies
+    def update_enemies(self):
+        enemies = self.enemies
+        bullets = self.bullets
+        rng = self.rng
+        # Player bullets don't move during this phase. Sorted by their left edge, so each enemy
+        # only looks at the ones in its x range: every bullets power-up adds one, with no cap
+        player_bullets = sorted(bullets.player_bullets(), key=itemgetter(1))
+        lefts = [left for _, left, _ in player_bullets]
+        hit_bullets = set()
+        dead_enemies = set()
+        for enemy in enemies:
+            enemy.move(self.frame_count)
             enemy.shoot_timer -= 1
             if enemy.shoot_timer <= 0:
                 shoots_bullets_enemy(enemy, bullets)
-                enemy.shoot_timer = random.randint(60, 180)
+                enemy.shoot_timer = rng.randint(60, 180)
 
             # Check for collisions with the bottom
             if enemy.y + enemy.height >= HEIGHT:
-                game_state = GAME_OVER
+                self.state = GAME_OVER
                 break
 
-            for bullet in bullets[:]:
-                if bullet.speed < 0 and bullet.rect.colliderect(enemy.rect):
-                    enemies.remove(enemy)
-                    bullets.remove(bullet)
-                    if random.random() < 0.5:
-                        power_type = random.choice(["speed", "bullets"])
-                        power_ups.append(PowerUp(enemy.x, enemy.y, power_type))
+            # Overlapping in x is rect.left - BULLET_WIDTH < left < rect.right. The candidates go
+            # back to index order, so the bullet that hits is the one a plain scan would find
+            rect = enemy.rect
+            start = bisect_left(lefts, rect.left - BULLET_WIDTH + 1)
+            for index, left, top in sorted(player_bullets[start:bisect_left(lefts, rect.right, start)]):
+                if index not in hit_bullets and top < rect.bottom and rect.top < top + BULLET_HEIGHT:
+                    dead_enemies.add(enemy)
+                    hit_bullets.add(index)
+                    if rng.random() < 0.5:
+                        power_type = rng.choice(["speed", "bullets"])
+                        self.power_ups.append(power_up_pool.acquire(enemy.x, enemy.y, power_type))
                     break
             if enemy.x <= 0 or enemy.x >= WIDTH - enemy.width:
-                enemy_direction *= -1
-                enemy_move_down = True
+                self.enemy_direction *= -1
+                self.enemy_move_down = True
 
-        if enemy_move_down:
+        # Remove the hits in one pass instead of a list.remove per hit
+        if dead_enemies:
+            release_from(enemies, dead_enemies, enemy_pool)
+        if hit_bullets:
+            bullets.remove(hit_bullets)
+
+        if self.enemy_move_down:
             for enemy in enemies:
                 enemy.y += 20
                 enemy.rect.topleft = (enemy.x, enemy.y)
-            enemy_move_down = False
+            self.enemy_move_down = False
         for enemy in enemies:
-            enemy.speed = enemy_direction * 2
-
-        # Boss logic
-        if boss:
-            boss.move()
-            boss.shoot_timer -= 1
-            boss.special_timer -= 1
-            boss.spawn_timer -= 1
-
-            if boss.shoot_timer <= 0:
-                boss.attack_type = random.randint(0, 2)
-                shoots_bullets_boss(boss, bullets)
-                boss.shoot_timer = random.randint(30, 120)
-
-            if boss.special_timer <= 0:
-                boss.attack_type = 3
-                shoots_bullets_boss(boss, bullets)
-                boss.special_timer = 300
-
-            # Spawn enemies every 10 seconds
-            if boss.spawn_timer <= 0:
-                for _ in range(4):
-                    x = random.randint(50, WIDTH - 50)
-                    enemies.append(Enemy(x, 50, random.choice(["normal", "sine"])))
-                boss.spawn_timer = 600
-
-        # Bullet movement
-        for bullet in bullets[:]:
-            bullet.move()
-            if bullet.y < 0 or bullet.y > HEIGHT or bullet.x < 0 or bullet.x > WIDTH:
-                bullets.remove(bullet)
-            elif bullet.speed > 0 and bullet.rect.colliderect(player.rect):
-                game_state = GAME_OVER
-            elif boss and bullet.speed < 0 and bullet.rect.colliderect(boss.rect):
+            enemy.speed = self.enemy_direction * 2
+
+    # Boss logic
+    def update_boss(self):
+        boss = self.boss
+        if not boss:
+            return
+        rng = self.rng
+        boss.move()
+        boss.shoot_timer -= 1
+        boss.special_timer -= 1
+        boss.spawn_timer -= 1
+
+        if boss.shoot_timer <= 0:
+            boss.attack_type = rng.randint(0, 2)
+            shoots_bullets_boss(boss, self.bullets, rng)
+            boss.shoot_timer = rng.randint(30, 120)
+
+        if boss.special_timer <= 0:
+            boss.attack_type = 3
+            shoots_bullets_boss(boss, self.bullets, rng)
+            boss.special_timer = 300
+
+        # Spawn enemies every 10 seconds
+        if boss.spawn_timer <= 0:
+            for _ in range(4):
+                x = rng.randint(50, WIDTH - 50)
+                type_ = rng.choice(["normal", "sine"])
+                self.enemies.append(enemy_pool.acquire(x, 50, type_, rng))
+            boss.spawn_timer = 600
+
+    # Bullet movement
+    def update_bullets(self):
+        bullets = self.bullets
+        bullets.move()
+        bullets.cull()
+
+        if len(bullets) and (bullets.overlaps(self.player.rect) & ~bullets.player[:len(bullets)]).any():
+            self.state = GAME_OVER
+
+        boss = self.boss
+        if boss and len(bullets):
+            hit_bullets = []
+            for index in np.flatnonzero(bullets.overlaps(boss.rect) & bullets.player[:len(bullets)]).tolist():
                 boss.health -= 10
-                bullets.remove(bullet)
+                hit_bullets.append(index)
                 if boss.health <= 0:
-                    boss = None
-                    round_num += 1
-                    enemies = [Enemy(x, 50, random.choice(["normal", "sine"])) for x in range(50, WIDTH - 50, 60)]  
+                    self.boss_kill_times.append(self.frame_count - self.boss_spawned)
+                    self.boss = None
+                    self.round_num += 1
+                    spawn_wave(self.enemies, self.rng)
+                    break
+            if hit_bullets:
+                bullets.remove(hit_bullets)
 
-        # Power-up movement and collection
-        for power_up in power_ups[:]:
+    # Power-up movement and collection
+    def update_power_ups(self):
+        power_ups = self.power_ups
+        player = self.player
+        for power_up in power_ups:
             power_up.move()
-            if power_up.rect.colliderect(player.rect):
-                if power_up.type == "speed":
+        if power_ups:
+            collected = player.rect.collidelistall(power_ups)
+            for index in collected:
+                if power_ups[index].type == "speed":
                     if player.speed < 9:
                         player.speed += 2
                         if player.speed > 9:
                             player.speed = 9
                     player.speed_timer = 1200
-                elif power_up.type == "bullets":
+                elif power_ups[index].type == "bullets":
                     player.max_bullets += 1
                     player.bullet_timer = 1200
-                power_ups.remove(power_up)
-            elif power_up.y > HEIGHT:
-                power_ups.remove(power_up)
-
-    # Clear the screen
-    screen.fill(BLACK)
-
-    # Game state "MENU"
-    if game_state == MENU:
-        title = default_font.render("Space Invaders", True, WHITE)
-        start = default_font.render("Press ENTER to Start", True, WHITE)
-        exit = default_font.render("Press Q to Exit", True, WHITE)
-        screen.blit(title, (WIDTH // 2 - title.get_width() // 2, HEIGHT // 2 - 100))
-        screen.blit(start, (WIDTH // 2 - start.get_width() // 2, HEIGHT // 2))
-        screen.blit(exit, (WIDTH // 2 - exit.get_width() // 2, HEIGHT // 2 + 50))
-
-    # Game state "PLAYING"
-    elif game_state == PLAYING:
-        player.draw()
-        for enemy in enemies:
-            enemy.draw()
-        for bullet in bullets:
-            bullet.draw()
-        for power_up in power_ups:
-            power_up.draw()
-        if boss:
-            boss.draw()
-
-        # Display round and level
-        text = default_font.render(f"ROUND: {round_num}  LEVEL: {level}", True, WHITE)
-        screen.blit(text, (10, 10))
-
-        # Display timers
-        speed_text = default_font.render(f"Speed Timer: {player.speed_timer // 60}", True, WHITE)
-        bullets_text = default_font.render(f"Bullets Timer: {player.bullet_timer // 60}", True, WHITE)
-        screen.blit(speed_text, (10, 50))
-        screen.blit(bullets_text, (10, 90))
-
-    # Display game state "PAUSED"
-    elif game_state == PAUSED:
-        paused = default_font.render("Paused", True, WHITE)
-        resume = default_font.render("Press ESC to Resume", True, WHITE)
-        exit_round = default_font.render("Press X to Exit Round", True, WHITE)
-        screen.blit(paused, (WIDTH // 2 - paused.get_width() // 2, HEIGHT // 2 - 50))
-        screen.blit(resume, (WIDTH // 2 - resume.get_width() // 2, HEIGHT // 2))
-        screen.blit(exit_round, (WIDTH // 2 - exit_round.get_width() // 2, HEIGHT // 2 + 50))
-
-    # Display game state "GAME OVER"
-    elif game_state == GAME_OVER:
-        lost = default_font.render("You've Lost", True, WHITE)
-        try_again = default_font.render("Press R to Try Again", True, WHITE)
-        exit = default_font.render("Press Q to Exit", True, WHITE)
-        screen.blit(lost, (WIDTH // 2 - lost.get_width() // 2, HEIGHT // 2 - 100))
-        screen.blit(try_again, (WIDTH // 2 - try_again.get_width() // 2, HEIGHT // 2))
-        screen.blit(exit, (WIDTH // 2 - exit.get_width() // 2, HEIGHT // 2 + 50))
-
-    pygame.display.flip()
-    frame_count += 1
-    clock.tick(60)
-
-pygame.quit()
-sys.exit()  
+            gone = set(power_ups[index] for index in collected)
+            gone.update(power_up for power_up in power_ups if power_up.y > HEIGHT)
+            if gone:
+                release_from(power_ups, gone, power_up_pool)
+
+    def entities(self):
+        yield self.player
+        yield from self.enemies
+        yield from self.power_ups
+        if self.boss:
+            yield self.boss
+
+    # Where to draw entity, alpha of the way from its position before the last update to its current one
+    def _lerp_rect(self, entity, alpha):
+        previous = self.previous.get(entity)
+        if previous is None or alpha >= 1.0:
+            return None
+        dx = entity.x - previous[0]
+        dy = entity.y - previous[1]
+        if abs(dx) > TELEPORT_DISTANCE or abs(dy) > TELEPORT_DISTANCE:
+            return None
+        rect = entity.rect.copy()
+        rect.topleft = (previous[0] + dx * alpha, previous[1] + dy * alpha)
+        return rect
+
+    # Draw onto surface. alpha is how far the render time is between the last update and the
+    # next one; redraw=False skips the screens that didn't change. Returns the rects that were
+    # drawn when rects is true (the DirtyRenderer needs them), otherwise an empty list.
+    def render(self, surface, alpha=1.0, redraw=True, rects=True):
+        drawn = []
+
+        # Game state "PLAYING"
+        if self.state == PLAYING:
+            lerp_rect = self._lerp_rect
+            player = self.player
+            pairs = [(sprites["player"], lerp_rect(player, alpha) or player.rect)]
+            for enemy in self.enemies:
+                pairs.append((sprites[enemy.type], lerp_rect(enemy, alpha) or enemy.rect))
+            pairs.extend(self.bullets.blit_pairs(alpha if self.interpolate else 1.0))
+            for power_up in self.power_ups:
+                pairs.append((sprites[power_up.type], lerp_rect(power_up, alpha) or power_up.rect))
+            boss = self.boss
+            if boss:
+                boss_rect = lerp_rect(boss, alpha) or boss.rect
+                pairs.append((sprites["boss"], boss_rect))
+            drawn = surface.blits(pairs, doreturn=rects) or []
+
+            # The boss's health bar changes width, it's the one thing still drawn as a rect
+            if boss:
+                health_bar = pygame.draw.rect(surface, GREEN, (boss_rect.x, boss_rect.y - 20, boss.health, 10))
+                if rects:
+                    drawn.append(health_bar)
+
+            # Display round and level, and the timers
+            hud = [
+                (text_cache.render(f"ROUND: {self.round_num}  LEVEL: {self.level}"), (10, 10)),
+                (text_cache.render(f"Speed Timer: {player.speed_timer // 60}"), (10, 50)),
+                (text_cache.render(f"Bullets Timer: {player.bullet_timer // 60}"), (10, 90)),
+            ]
+            if rects:
+                drawn.extend(surface.blits(hud))
+            else:
+                surface.blits(hud, doreturn=False)
+
+        # Game states "MENU", "PAUSED" and "GAME OVER", they only change when the state does
+        elif redraw:
+            surface.blits(static_screens[self.state], doreturn=False)
+        return drawn
+
+    def counts(self):
+        return {
+            "enemies": len(self.enemies),
+            "bullets": len(self.bullets),
+            "player_bullets": self.bullets.player_count(),
+            "power_ups": len(self.power_ups),
+            "boss": int(self.boss is not None),
+        }
+
+    # Hash of everything the simulation depends on, equal checksums mean a replay played out exactly like the recording
+    def checksum(self):
+        digest = hashlib.sha256()
+        digest.update(repr((self.frame_count, self.state, self.round_num, self.level, self.enemy_direction,
+                            self.rng.getstate())).encode())
+        digest.update(repr([getattr(self.player, name) for name in Player.__slots__ if name != "rect"]).encode())
+        for enemy in self.enemies:
+            digest.update(repr((enemy.x, enemy.y, enemy.type, enemy.speed, enemy.health,
+                                enemy.shoot_timer, enemy.sine_offset)).encode())
+        bullets = self.bullets
+        count = len(bullets)
+        for values in (bullets.x, bullets.y, bullets.vx, bullets.vy, bullets.player):
+            digest.update(values[:count].tobytes())
+        for power_up in self.power_ups:
+            digest.update(repr((power_up.x, power_up.y, power_up.type)).encode())
+        if self.boss:
+            digest.update(repr([getattr(self.boss, name) for name in Boss.__slots__ if name != "rect"]).encode())
+        return digest.hexdigest()
+
+    def stats(self):
+        return {
+            "frames": self.frame_count,
+            "games": self.games,
+            "round": self.round_num,
+            "level": self.level,
+            "state": self.state,
+            "pools": {"enemies": enemy_pool.stats(), "power_ups": power_up_pool.stats()},
+            "profiler": self.profiler,
+            "checksum": self.checksum(),
+        }
+
+# Run a game. Headless skips rendering and the clock, so the simulation runs as fast as
+# the CPU allows; max_frames stops it after that many updates. Otherwise updates happen
+# every STEP of real time and rendering runs at up to fps, drawing moving things in between
+# their last two positions. dirty_rects switches to the DirtyRenderer, a FrameProfiler
+# times every phase of every frame.
+def run_game(input_provider=None, headless=False, max_frames=None, dirty_rects=False, profiler=None, seed=None, fps=FPS):
+    input_provider = input_provider or KeyboardInput()
+    game = Game(seed, profiler, interpolate=not headless)
+
+    def more():
+        return game.running and (max_frames is None or game.frame_count < max_frames)
+
+    if headless:
+        while more():
+            if game.profiler:
+                game.profiler.start()
+            game.step(input_provider)
+            if game.profiler:
+                game.profiler.end(game.frame_count - 1, game.counts())
+        return game.stats()
+
+    renderer = DirtyRenderer(screen) if dirty_rects else None
+    clock = pygame.time.Clock()
+    accumulator = 0.0
+    last = time.perf_counter()
+    while more():
+        now = time.perf_counter()
+        accumulator = min(accumulator + now - last, MAX_STEPS_PER_FRAME * STEP)
+        last = now
+        if game.profiler:
+            game.profiler.start()
+        while accumulator >= STEP and more():
+            game.step(input_provider)
+            accumulator -= STEP
+        profiler = game.profiler
+
+        # Clear the screen
+        if renderer:
+            redraw = renderer.begin(game.state)
+        else:
+            screen.fill(BLACK)
+            redraw = True
+        drawn = game.render(screen, accumulator / STEP, redraw, rects=renderer is not None)
+
+        if profiler:
+            if profiler.overlay:
+                drawn.extend(profiler.draw(screen, game.frame_count, game.counts()))
+            profiler.mark("render")
+
+        if renderer:
+            renderer.finish(drawn)
+        else:
+            pygame.display.flip()
+
+        if profiler:
+            profiler.mark("flip")
+            profiler.end(game.frame_count, game.counts())
+        clock.tick(fps)
+
+    return game.stats()
+
+# Batch runs: many seeded headless games spread over processes, to tune difficulty on
+# statistics instead of single sessions. Every game starts at round 1 and ends at its
+# first game over, or after max_frames updates.
+BATCH_FILE = "space_invaders_batch.npz"
+BATCH_CHUNK_SIZE = 8 # Games per task, enough to keep the inter-process traffic small
+BATCH_COLUMNS = {
+    "seed": np.int64,
+    "rounds": np.int32,        # Round reached
+    "frames": np.int32,        # Updates until death (or the cap)
+    "died": np.bool_,
+    "shots": np.int32,         # Bullets the player fired
+    "boss_kills": np.int32,
+    "boss_kill_time": np.int32, # Updates to kill the first boss, -1 when none was killed
+}
+
+def play_batch_game(seed, policy="random", max_frames=60 * 60 * 10):
+    game = Game(seed)
+    inputs = POLICIES[policy](seed, game)
+    game.state = PLAYING
+    while game.state != GAME_OVER and game.frame_count < max_frames:
+        game.step(inputs)
+    return (seed, game.round_num, game.frame_count, game.state == GAME_OVER, game.shots,
+            len(game.boss_kill_times), game.boss_kill_times[0] if game.boss_kill_times else -1)
+
+def _play_chunk(seeds, policy, max_frames):
+    return [play_batch_game(seed, policy, max_frames) for seed in seeds]
+
+# Plays games seeds first_seed .. first_seed + games - 1, returns one array per column in seed order
+def run_batch(games, policy="random", workers=None, first_seed=0, max_frames=60 * 60 * 10,
+              chunk_size=BATCH_CHUNK_SIZE):
+    workers = workers or os.cpu_count()
+    seeds = range(first_seed, first_seed + games)
+    chunks = [seeds[i:i + chunk_size] for i in range(0, games, chunk_size)]
+    if workers == 1:
+        results = map(_play_chunk, chunks, repeat(policy), repeat(max_frames))
+        rows = [row for chunk in results for row in chunk]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as executor:
+            results = executor.map(_play_chunk, chunks, repeat(policy), repeat(max_frames))
+            rows = [row for chunk in results for row in chunk]
+    return {name: np.array(column, dtype) for (name, dtype), column in zip(BATCH_COLUMNS.items(), zip(*rows))}
+
+# One compressed array per column, np.load(path) gives them back by name
+def save_batch(path, columns):
+    np.savez_compressed(path, **columns)
+
+def batch_summary(columns):
+    rounds = columns["rounds"]
+    seconds = columns["frames"] / 60
+    killed = columns["boss_kill_time"][columns["boss_kill_time"] >= 0] / 60
+    lines = [
+        f"Rounds reached: mean {rounds.mean():.2f}, median {np.median(rounds):.0f}, p90 {np.percentile(rounds, 90):.0f}, max {rounds.max()}",
+        f"Time to death: mean {seconds.mean():.1f}s, median {np.median(seconds):.1f}s ({columns['died'].mean():.1%} of games died)",
+        f"Bullets fired: mean {columns['shots'].mean():.1f}",
+        f"Boss killed in {columns['boss_kills'].astype(bool).mean():.1%} of games",
+    ]
+    if len(killed):
+        lines.append(f"First boss kill time: mean {killed.mean():.1f}s, median {np.median(killed):.1f}s")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Space Invaders")
+    parser.add_argument("--headless", action="store_true", help="no window, no frame cap, a random player plays")
+    parser.add_argument("--frames", type=int, help="stop after this many updates (60 per second of play)")
+    parser.add_argument("--fps", type=int, default=FPS, help="render frame cap, the game itself always updates 60 times a second")
+    parser.add_argument("--seed", type=int, help="seed for the game and the random player")
+    parser.add_argument("--record", metavar="PATH", help="save the seed and every input to a replay file")
+    parser.add_argument("--replay", metavar="PATH", help="play a recorded session back and check it ends the same way")
+    parser.add_argument("--profile", metavar="PATH", help="time every frame phase and write them to a CSV (or .json) file")
+    parser.add_argument("--overlay", action="store_true", help="show the profiler overlay from the start (F3 toggles it)")
+    parser.add_argument("--dirty-rects", action="store_true", help="only redraw the parts of the screen that change")
+    parser.add_argument("--batch", type=int, metavar="GAMES", help="play this many headless games in parallel and save their statistics")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="random", help="player for --batch")
+    parser.add_argument("--workers", type=int, help="processes for --batch (default: one per CPU)")
+    parser.add_argument("--output", default=BATCH_FILE, help="columnar .npz file for the --batch statistics")
+    args = parser.parse_args()
+
+    if args.batch:
+        start = time.perf_counter()
+        columns = run_batch(args.batch, args.policy, args.workers, args.seed or 0, args.frames or 60 * 60 * 10)
+        elapsed = time.perf_counter() - start
+        save_batch(args.output, columns)
+        print(f"Played {args.batch} games in {elapsed:.1f}s ({args.batch / elapsed:.1f} games/s), "
+              f"{columns['frames'].sum() / elapsed:.0f} updates/s")
+        print(batch_summary(columns))
+        print(f"Statistics written to {args.output}")
+        sys.exit()
+
+    init_display(args.headless)
+    profiler = None
+    if args.profile or args.overlay:
+        profiler = FrameProfiler(output=args.profile, overlay=args.overlay)
+    recording = None
+    if args.replay:
+        recording = load_recording(args.replay)
+        args.seed = recording["seed"]
+        args.frames = recording["frames"]
+    elif args.seed is None and args.record:
+        args.seed = random.randrange(2 ** 32) # A recording needs a known seed
+    if recording:
+        input_provider = replay = ReplayInput(recording, window=not args.headless)
+    elif args.headless:
+        input_provider = RandomInput(input_seed(args.seed))
+    else:
+        input_provider = KeyboardInput()
+    if args.record:
+        input_provider = RecordingInput(input_provider)
+
+    if args.headless:
+        start = time.perf_counter()
+        stats = run_game(input_provider, headless=True, max_frames=args.frames or 60 * 60 * 60, profiler=profiler, seed=args.seed)
+        elapsed = time.perf_counter() - start
+        print(f"Simulated {stats['frames']} frames ({stats['frames'] / 3600:.1f} minutes of play) in {elapsed:.1f}s, "
+              f"{stats['frames'] / elapsed:.0f} frames/s")
+        print(f"Games: {stats['games']}  last round: {stats['round']}  level: {stats['level']}")
+        for name, pool in stats["pools"].items():
+            print(f"Pool {name}: {pool['size']} objects, {pool['acquired']} acquired, {pool['hit_rate']:.1%} reused")
+    else:
+        stats = run_game(input_provider, max_frames=args.frames, dirty_rects=args.dirty_rects, profiler=profiler, seed=args.seed,
+                         fps=args.fps)
+    if stats["profiler"]:
+        print(stats["profiler"].summary())
+        stats["profiler"].close()
+    if args.record:
+        input_provider.save(args.record, args.seed, stats)
+        print(f"Recorded {stats['frames']} frames to {args.record}, checksum {stats['checksum'][:16]}")
+    pygame.quit()
+    if recording and replay.stopped:
+        print(f"Replay stopped at frame {stats['frames']} of {recording['frames']}")
+    elif recording:
+        if stats["checksum"] != recording["checksum"] or stats["frames"] != recording["frames"]:
+            print(f"Replay diverged: checksum {stats['checksum'][:16]}, recorded {recording['checksum'][:16]}")
+            sys.exit(1)
+        print(f"Replay matched the recording, checksum {stats['checksum'][:16]}")
+    sys.exit()
@@ -0,0 +1,211 @@
+# Stress benchmarks for space_invaders.py
+# Runs scripted scenarios headlessly for a fixed number of frames, times the update and the
+# render of every frame, writes the results as JSON and compares them with a stored baseline,
+# so collision, movement or rendering changes can be judged on numbers.
+#
+#   python space_invaders_benchmark.py                          # all scenarios, 600 frames each
+#   python space_invaders_benchmark.py --scenarios bullets      # just one
+#   python space_invaders_benchmark.py --save-baseline          # accept the current numbers
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import space_invaders as si
+
+RESULTS_FILE = "space_invaders_bench.json"
+BASELINE_FILE = "space_invaders_baseline.json"
+TOLERANCE = 0.15 # Slower than the baseline by more than this is a regression
+FRAMES = 600
+WARMUP = 30 # Frames run before measuring, so the pools and caches are filled
+ALLOC_FRAMES = 100 # Frames run again under tracemalloc, which is too slow for the timings
+SEED = 1
+
+# A scenario sets the game up once (setup) and keeps the pressure on before every frame (refill)
+
+# One full wave on the field, as the game spawns it
+def full_wave_setup(game, rng):
+    si.spawn_wave(game.enemies, game.rng)
+
+def full_wave_refill(game, rng):
+    if not game.enemies:
+        si.spawn_wave(game.enemies, game.rng)
+
+# A level 10 boss firing its 10-bullet special attack every frame
+def boss_setup(game, rng):
+    game.round_num = 50
+    game.level = 10
+    game.boss = si.Boss(game.round_num, game.rng)
+
+def boss_refill(game, rng):
+    if not game.boss:
+        boss_setup(game, rng)
+    game.boss.special_timer = 1
+    game.boss.health = max(game.boss.health, 100)
+
+# Thousands of bullets both ways, topped up as they leave the screen
+BULLET_COUNT = 3000
+
+def bullets_refill(game, rng):
+    bullets = game.bullets
+    for _ in range(BULLET_COUNT - len(bullets)):
+        if rng.random() < 0.5:
+            bullets.spawn(rng.uniform(0, si.WIDTH), rng.uniform(si.HEIGHT / 2, si.HEIGHT), rng.uniform(-30, 30))
+        else:
+            bullets.spawn(rng.uniform(0, si.WIDTH), rng.uniform(0, si.HEIGHT / 2), rng.uniform(-30, 30), speed=5)
+
+# A rain of power-ups over the whole screen
+POWER_UP_COUNT = 300
+
+def power_ups_refill(game, rng):
+    for _ in range(POWER_UP_COUNT - len(game.power_ups)):
+        power_type = rng.choice(["speed", "bullets"])
+        game.power_ups.append(si.power_up_pool.acquire(rng.uniform(0, si.WIDTH - 20), rng.uniform(-si.HEIGHT, 0), power_type))
+
+# Just what the refill adds: a boss round with no boss never spawns a wave
+def empty_setup(game, rng):
+    game.round_num = 5
+
+SCENARIOS = {
+    "full_wave": (full_wave_setup, full_wave_refill),
+    "boss": (boss_setup, boss_refill),
+    "bullets": (empty_setup, bullets_refill),
+    "power_ups": (empty_setup, power_ups_refill),
+}
+
+def new_game(name):
+    setup, refill = SCENARIOS[name]
+    rng = random.Random(SEED)
+    game = si.Game(SEED)
+    for enemy in game.enemies: # Every scenario starts from an empty field
+        si.enemy_pool.release(enemy)
+    game.enemies.clear()
+    game.state = si.PLAYING
+    setup(game, rng)
+    return game, rng, refill
+
+# One frame: the scenario's refill, an update and a render. Dying doesn't end a stress test
+def play_frame(game, rng, refill, inputs):
+    refill(game, rng)
+    start = time.perf_counter()
+    game.step(inputs)
+    middle = time.perf_counter()
+    game.state = si.PLAYING
+    si.screen.fill(si.BLACK)
+    game.render(si.screen, rects=False)
+    return middle - start, time.perf_counter() - middle
+
+def summarize(times):
+    times = sorted(times)
+    return {
+        "mean": statistics.fmean(times),
+        "median": statistics.median(times),
+        "p99": times[min(len(times) - 1, int(len(times) * 0.99))],
+        "min": times[0],
+        "max": times[-1],
+        "frames": len(times),
+    }
+
+def bench_scenario(results, name, frames):
+    game, rng, refill = new_game(name)
+    inputs = si.RandomInput(si.input_seed(SEED))
+    for _ in range(WARMUP):
+        play_frame(game, rng, refill, inputs)
+    update, render = [], []
+    for _ in range(frames):
+        update_time, render_time = play_frame(game, rng, refill, inputs)
+        update.append(update_time)
+        render.append(render_time)
+    results[f"{name}/update"] = summarize(update)
+    results[f"{name}/render"] = summarize(render)
+
+    # Allocations: the memory a frame allocates on top of what was live when it started
+    tracemalloc.start()
+    allocated = []
+    for _ in range(ALLOC_FRAMES):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        play_frame(game, rng, refill, inputs)
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    results[f"{name}/allocated_bytes"] = summarize(allocated)
+
+    counts = game.counts()
+    print(f"{name:10} update {results[f'{name}/update']['mean'] * 1e3:7.3f} ms (p99 {results[f'{name}/update']['p99'] * 1e3:7.3f})"
+          f"  render {results[f'{name}/render']['mean'] * 1e3:7.3f} ms (p99 {results[f'{name}/render']['p99'] * 1e3:7.3f})"
+          f"  {results[f'{name}/allocated_bytes']['mean'] / 1024:8.1f} KiB/frame"
+          f"  [{counts['enemies']} enemies, {counts['bullets']} bullets, {counts['power_ups']} power-ups]")
+
+# Compare the median of each benchmark with the baseline (means and tails are too noisy
+# on a busy machine), returns the names that got worse than the tolerance allows
+def compare(results, baseline, tolerance=TOLERANCE):
+    regressions = []
+    print(f"\n{'benchmark':28} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["median"]
+        ratio = current["median"] / before if before else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        unit = 1 if name.endswith("bytes") else 1e6
+        print(f"{name:28} {before * unit:12.1f} {current['median'] * unit:12.1f} {ratio:7.2f}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stress benchmarks for space_invaders.py.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--frames", type=int, default=FRAMES, help="measured frames per scenario")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    si.init_display(True)
+    results = {}
+    for name in args.scenarios:
+        bench_scenario(results, name, args.frames)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pygame": si.pygame.version.ver,
+            "numpy": si.np.__version__,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "frames": args.frames,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=4)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) worse than the baseline by more than {args.tolerance:.0%}.")
+        return 1
+    print("\nNo regressions.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())